@@ -3,17 +3,33 @@
 
 from forest.components.branch.object import Branch
 from forest.components.branch.handlers import LeavesHandler, LeafHandler, SpeciesListHandler, \
-    SpeciesHandler, LoggerHandler, LoggerListHandler, LeafRPCHandler
+    SpeciesHandler, LoggerHandler, LoggerListHandler, LeafRPCHandler, LeavesStatusHandler, \
+    RPCBroadcastHandler, StartQueueHandler, LeafLifecycleHandler, ColdStartHandler, LeafMemoryHandler, \
+    MediaHandler, MediaCacheHandler, LeafCacheHandler, BuildListHandler, BuildHandler, \
+    SpeciesRollbackHandler
 
 
 branch_handlers = [
     # API листьев
     (r"/api/branch/leaf$", LeavesHandler),
+    (r"/api/branch/leaf/status$", LeavesStatusHandler),
     (r"/api/branch/leaf/([0-9a-fA-F]{24})$", LeafHandler),
     (r"/api/branch/leaf/([0-9a-fA-F]{24})/rpc$", LeafRPCHandler),
+    (r"/api/branch/leaf/([0-9a-fA-F]{24})/lifecycle$", LeafLifecycleHandler),
+    (r"/api/branch/leaf/([0-9a-fA-F]{24})/memory$", LeafMemoryHandler),
+    (r"/api/branch/leaf/([0-9a-fA-F]{24})/cache$", LeafCacheHandler),
+    (r"/api/branch/rpc$", RPCBroadcastHandler),
+    (r"/api/branch/queue$", StartQueueHandler),
+    (r"/api/branch/coldstart$", ColdStartHandler),
+    (r"/api/branch/media$", MediaCacheHandler),
+    # Медиа-файлы листьев
+    (r"/media/(.+)$", MediaHandler),
     # API видов
     (r"/api/branch/species$", SpeciesListHandler),
     (r"/api/branch/species/([0-9a-fA-F]{24})$", SpeciesHandler),
+    (r"/api/branch/species/([0-9a-fA-F]{24})/rollback$", SpeciesRollbackHandler),
+    (r"/api/branch/build$", BuildListHandler),
+    (r"/api/branch/build/([0-9a-fA-F]{24})$", BuildHandler),
     # API логгеров
     (r"/api/branch/loggers$", LoggerListHandler),
     (r"/api/branch/loggers/([0-9a-fA-F]{*})$", LoggerHandler)
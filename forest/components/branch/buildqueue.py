@@ -0,0 +1,220 @@
+# coding=utf-8
+"""Модуль описывает очередь сборки видов ветви."""
+
+from __future__ import print_function, unicode_literals
+
+import time
+import traceback
+from collections import OrderedDict
+
+from bson import ObjectId
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+from toro import Condition
+
+from forest.components.common import log_message
+
+
+# pylint: disable=W0702
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+
+
+class Build(object):
+
+    """Сборка вида."""
+
+    def __init__(self, key, version, task, priority=0):
+        """Инициализирует сборку.
+
+        :param key: Идентификатор собираемого вида
+        :type key: str
+        :param version: Версия собираемого вида
+        :type version: object
+        :param task: Функция, выполняющая сборку и возвращающая Future
+        :type task: function
+        :param priority: Приоритет сборки, сборки с большим приоритетом выполняются раньше
+        :type priority: int
+        """
+        self.id = str(ObjectId())
+        self.key = key
+        self.version = version
+        self.task = task
+        self.priority = priority
+        self.state = QUEUED
+        self.error = None
+        self.requests = 1
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def dict(self):
+        """Описание сборки.
+
+        :returns: Словарь с состоянием и временами сборки
+        :rtype: dict
+        """
+        now = time.time()
+
+        return {
+            "_id": self.id,
+            "species": self.key,
+            "state": self.state,
+            "priority": self.priority,
+            "requests": self.requests,
+            "error": self.error,
+            "created": self.created,
+            "wait": (self.started or now) - self.created,
+            "duration": (self.finished or now) - self.started if self.started else None
+        }
+
+
+class BuildQueue(object):
+
+    """Очередь сборки видов с ограниченным количеством одновременных сборок.
+
+    Сборки выполняются workers обработчиками в порядке убывания приоритета, при равных приоритетах - в
+    порядке постановки в очередь. Повторный запрос сборки вида, уже стоящего в очереди, не создает новую
+    сборку: ожидающая сборка получает новую функцию сборки и наибольший из приоритетов. Запрос сборки
+    той же версии, что собирается в данный момент, возвращает выполняющуюся сборку. Два обработчика
+    никогда не собирают один вид одновременно.
+    """
+
+    def __init__(self, workers=2, history=100):
+        """Инициализирует очередь и запускает обработчики.
+
+        :param workers: Количество одновременных сборок
+        :type workers: int
+        :param history: Количество хранимых завершенных сборок
+        :type history: int
+        """
+        self.__workers__ = workers
+        self.__history__ = history
+        self.__queue__ = OrderedDict()
+        self.__running__ = {}
+        self.__builds__ = OrderedDict()
+        self.__condition__ = Condition()
+
+        for _ in range(workers):
+            IOLoop.current().spawn_callback(self.__worker__)
+
+    def submit(self, key, version, task, priority=0):
+        """Ставит сборку вида в очередь.
+
+        :param key: Идентификатор собираемого вида
+        :type key: str
+        :param version: Версия собираемого вида
+        :type version: object
+        :param task: Функция, выполняющая сборку и возвращающая Future
+        :type task: function
+        :param priority: Приоритет сборки
+        :type priority: int
+        :returns: Созданная или уже существующая сборка
+        :rtype: Build
+        """
+        running = self.__running__.get(key)
+        if running and running.version == version:
+            running.requests += 1
+            return running
+
+        build = self.__queue__.get(key)
+        if build:
+            build.version = version
+            build.task = task
+            build.priority = max(build.priority, priority)
+            build.requests += 1
+            return build
+
+        build = Build(key, version, task, priority)
+        self.__queue__[key] = build
+        self.__builds__[build.id] = build
+        self.__condition__.notify_all()
+
+        return build
+
+    def get(self, build_id):
+        """Возвращает сборку по идентификатору.
+
+        :param build_id: Идентификатор сборки
+        :type build_id: str
+        :rtype: Build
+        """
+        return self.__builds__.get(build_id)
+
+    def latest(self, key):
+        """Возвращает последнюю сборку вида.
+
+        :param key: Идентификатор вида
+        :type key: str
+        :rtype: Build
+        """
+        return self.__queue__.get(key) or self.__running__.get(key) or next(
+            (_ for _ in reversed(list(self.__builds__.values())) if _.key == key), None
+        )
+
+    @property
+    def stats(self):
+        """Состояние очереди.
+
+        :returns: Словарь с количеством ожидающих и выполняющихся сборок и списком последних сборок
+        :rtype: dict
+        """
+        return {
+            "workers": self.__workers__,
+            "queued": len(self.__queue__),
+            "running": len(self.__running__),
+            "builds": [_.dict for _ in reversed(list(self.__builds__.values()))]
+        }
+
+    def __pick__(self):
+        """Выбирает следующую сборку.
+
+        :returns: Сборка с наибольшим приоритетом, вид которой не собирается в данный момент, или None
+        :rtype: Build
+        """
+        candidates = [_ for _ in self.__queue__.values() if _.key not in self.__running__]
+
+        if not candidates:
+            return None
+
+        return max(candidates, key=lambda build: (build.priority, -build.created))
+
+    @coroutine
+    def __worker__(self):
+        """Выполняет сборки из очереди."""
+        while True:
+            build = self.__pick__()
+
+            if not build:
+                yield self.__condition__.wait()
+                continue
+
+            del self.__queue__[build.key]
+            self.__running__[build.key] = build
+            build.state = RUNNING
+            build.started = time.time()
+
+            try:
+                yield build.task()
+                build.state = SUCCESS
+            except:
+                build.state = FAILED
+                build.error = traceback.format_exc().splitlines()[-1]
+                log_message("Build {} of {} failed: {}".format(build.id, build.key, build.error), "Branch")
+
+            build.finished = time.time()
+            del self.__running__[build.key]
+            self.__trim__()
+            self.__condition__.notify_all()
+
+    def __trim__(self):
+        """Удаляет самые старые завершенные сборки сверх history."""
+        finished = [_ for _ in self.__builds__.values() if _.finished]
+
+        for build in finished[:max(len(finished) - self.__history__, 0)]:
+            del self.__builds__[build.id]
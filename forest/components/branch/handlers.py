@@ -3,11 +3,16 @@
 
 from __future__ import unicode_literals
 
+import mimetypes
+import time
+
 from bson import ObjectId
 from forest.components.api.decorators import token_auth
 from forest.components.common import loads, dumps
 from forest.components.branch.loggers import Logger
+from forest.components.branch.mediacache import MediaCache
 from forest.components.species import Species
+from forest.jsonschema.decorators import schema
 from tornado import gen, web
 
 
@@ -48,6 +53,37 @@ class LeavesHandler(web.RequestHandler):
         except Species.NotDefined:
             self.set_status(400)
             self.finish(dumps({"result": "error", "message": "Unknown species"}))
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+
+
+class LeavesStatusHandler(web.RequestHandler):
+
+    """Выполняет массовое получение статуса листьев."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self):
+        """Возвращает статус всех листьев или листьев, подходящих под фильтр.
+
+        Листья фильтруются по аргументам id (может быть указан несколько раз) и species.
+        """
+        max_staleness = self.get_argument("max_staleness", None)
+
+        try:
+            max_staleness = float(max_staleness) if max_staleness is not None else None
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+            raise gen.Return()
+
+        status = yield self.application.branch.leaves_status(
+            leaf_ids=self.get_arguments("id"),
+            species_id=self.get_argument("species", None),
+            max_staleness=max_staleness
+        )
+        self.finish(dumps(status))
 
 
 class LeafHandler(web.RequestHandler):
@@ -57,8 +93,21 @@ class LeafHandler(web.RequestHandler):
     @gen.coroutine
     @token_auth
     def get(self, _id):
-        """Получает информацию о листе с указанным id."""
-        self.finish(dumps(self.application.emperor.stats(_id)))
+        """Получает информацию о листе с указанным id.
+
+        Необязательный аргумент max_staleness задает максимально допустимый возраст статистики в секундах.
+        """
+        max_staleness = self.get_argument("max_staleness", None)
+
+        try:
+            max_staleness = float(max_staleness) if max_staleness is not None else None
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+            raise gen.Return()
+
+        stats = yield self.application.emperor.stats(_id, max_staleness=max_staleness)
+        self.finish(dumps(stats))
 
     @gen.coroutine
     @token_auth
@@ -71,6 +120,82 @@ class LeafHandler(web.RequestHandler):
         self.finish()
 
 
+class LeafLifecycleHandler(web.RequestHandler):
+
+    """Выполняет получение жизненного цикла листа."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self, _id):
+        """Возвращает текущее состояние, счетчики и историю переходов листа."""
+        leaf = self.application.branch.leaves.get(_id)
+
+        if leaf:
+            self.finish(dumps(leaf.lifecycle.dict))
+        else:
+            self.set_status(404)
+            self.finish(dumps({}))
+
+
+class LeafMemoryHandler(web.RequestHandler):
+
+    """Выполняет получение использования памяти листом."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self, _id):
+        """Возвращает разделяемую и приватную память мастер-процесса и каждого воркера листа."""
+        memory = yield self.application.emperor.memory(_id)
+
+        if memory:
+            self.finish(dumps(memory))
+        else:
+            self.set_status(404)
+            self.finish(dumps({}))
+
+
+class LeafCacheHandler(web.RequestHandler):
+
+    """Выполняет работу с кэшем ответов листа."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self, _id):
+        """Возвращает правила кэширования листа и состояние его кэша."""
+        leaf = self.application.branch.leaves.get(_id)
+
+        if not leaf or not leaf.cache:
+            self.set_status(404)
+            self.finish(dumps({}))
+            raise gen.Return()
+
+        stats = yield self.application.emperor.vassal_stats(leaf.id)
+        self.finish(dumps({
+            "rules": leaf.cache,
+            "caches": [_ for _ in (stats or {}).get("caches", []) if _.get("name") == "responses"]
+        }))
+
+    @gen.coroutine
+    @token_auth
+    def delete(self, _id):
+        """Очищает кэш ответов листа вызовом его rpc-функции forest_cache_clear."""
+        leaf = self.application.branch.leaves.get(_id)
+
+        if not leaf or not leaf.cache:
+            self.set_status(404)
+            self.finish(dumps({}))
+            raise gen.Return()
+
+        response = yield self.application.emperor.call_vassal_rpc(leaf.id, "forest_cache_clear")
+
+        if response["result"] != "success":
+            self.set_status(502)
+            self.finish(dumps(response))
+            raise gen.Return()
+
+        self.finish(dumps({"result": "success"}))
+
+
 class LeafRPCHandler(web.RequestHandler):
 
     """Выполняет работу с uwsgi-rpc приложения."""
@@ -78,13 +203,158 @@ class LeafRPCHandler(web.RequestHandler):
     @gen.coroutine
     @token_auth
     def post(self, _id):
-        """Обрабатывает rpc-запрос."""
-        data = loads(self.request.body)
-        assert type(data) == list
+        """Обрабатывает rpc-запрос.
+
+        Необязательный аргумент timeout задает таймаут вызова в секундах.
+        """
+        timeout = self.get_argument("timeout", None)
+
+        try:
+            data = loads(self.request.body)
+
+            if not isinstance(data, list) or not data:
+                raise ValueError("RPC call must be a non-empty list of strings")
+
+            response = yield self.application.emperor.call_vassal_rpc(
+                _id, *data,
+                timeout=float(timeout) if timeout is not None else None
+            )
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+        else:
+            self.finish(dumps(response))
+
+
+class RPCBroadcastHandler(web.RequestHandler):
+
+    """Выполняет вызов uwsgi-rpc на множестве листьев."""
+
+    @gen.coroutine
+    @token_auth
+    @schema("rpc")
+    def post(self, args, leaves=None, species=None, address=None, parallelism=10, timeout=None, **kwargs):
+        """Вызывает rpc-функцию на листьях, выбранных по списку идентификаторов, виду или шаблону адреса."""
+        started = time.time()
+
+        try:
+            results = yield self.application.branch.broadcast_rpc(
+                args,
+                leaf_ids=leaves,
+                species_id=species,
+                address=address,
+                parallelism=parallelism,
+                timeout=timeout
+            )
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+            raise gen.Return()
 
-        response = yield self.application.emperor.call_vassal_rpc(_id, *data)
+        self.finish(dumps({
+            "result": "success",
+            "leaves": results,
+            "time": time.time() - started
+        }))
 
-        self.finish(dumps(response))
+
+class StartQueueHandler(web.RequestHandler):
+
+    """Выполняет работу с очередью запуска листьев."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self):
+        """Возвращает глубину очереди запуска и времена ожидания."""
+        self.finish(dumps(self.application.emperor.start_queue))
+
+
+class ColdStartHandler(web.RequestHandler):
+
+    """Выполняет получение статистики длительности запуска листьев."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self):
+        """Возвращает перцентили длительности запуска по видам и листьям.
+
+        Необязательный аргумент species ограничивает ответ одним видом и его листьями.
+        """
+        self.finish(dumps(self.application.branch.cold_start_summary(self.get_argument("species", None))))
+
+
+class MediaHandler(web.RequestHandler):
+
+    """Отдает медиа-файлы листьев через кэш ветви."""
+
+    @gen.coroutine
+    def get(self, filename):
+        """Отдает медиа-файл листа, определяемого по заголовку Host.
+
+        :param filename: Имя файла в GridFS
+        :type filename: str
+        """
+        branch = self.application.branch
+        leaf = branch.leaf_by_address(self.request.host.split(":")[0])
+        database = branch.media_database(leaf) if leaf and branch.media_cache else None
+
+        if not database:
+            raise web.HTTPError(404)
+
+        result = yield branch.media_cache.get(leaf.id, database, filename)
+        if not result:
+            raise web.HTTPError(404)
+
+        meta, data = result
+        etag = '"{}"'.format(meta.get("md5") or MediaCache.key(meta))
+
+        self.set_header("Etag", etag)
+        self.set_header("Content-Type", meta.get("contentType") or
+                        mimetypes.guess_type(filename)[0] or "application/octet-stream")
+
+        if meta.get("uploadDate"):
+            self.set_header("Last-Modified", meta["uploadDate"])
+
+        if self.request.headers.get("If-None-Match") == etag:
+            self.set_status(304)
+            self.finish()
+        elif data is not None:
+            self.finish(data)
+        else:
+            def write(chunk):
+                self.write(chunk)
+                return self.flush()
+
+            self.set_header("Content-Length", meta["length"])
+            yield branch.media_cache.stream(database, meta, write)
+            self.finish()
+
+    def compute_etag(self):
+        return None
+
+
+class MediaCacheHandler(web.RequestHandler):
+
+    """Выполняет работу с кэшем медиа-файлов ветви."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self):
+        """Возвращает метрики кэша медиа-файлов."""
+        if self.application.branch.media_cache:
+            self.finish(dumps(self.application.branch.media_cache.stats))
+        else:
+            self.set_status(404)
+            self.finish(dumps({"result": "error", "message": "Media cache is disabled"}))
+
+    @gen.coroutine
+    @token_auth
+    def delete(self):
+        """Сбрасывает метаданные файлов всех листьев или листа, указанного аргументом leaf."""
+        if self.application.branch.media_cache:
+            self.application.branch.media_cache.invalidate(self.get_argument("leaf", None))
+
+        self.finish(dumps({"result": "success"}))
 
 
 class SpeciesListHandler(web.RequestHandler):
@@ -97,9 +367,15 @@ class SpeciesListHandler(web.RequestHandler):
         """Инициализирует новый вид приложения."""
         data = loads(self.request.body)
 
-        yield self.application.branch.create_species(data)
-
-        self.finish(dumps({"result": "success", "message": "OK"}))
+        try:
+            priority = int(self.get_argument("priority", 0))
+            species = yield self.application.branch.create_species(data, priority=priority)
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+        else:
+            build = self.application.branch.builds.latest(species.id)
+            self.finish(dumps({"result": "success", "message": "OK", "build": build.id}))
 
 
 class SpeciesHandler(web.RequestHandler):
@@ -126,9 +402,63 @@ class SpeciesHandler(web.RequestHandler):
         """Модифицирует указанный вид приложения."""
         data = loads(self.request.body)
 
-        self.application.branch.create_species(data)
+        try:
+            priority = int(self.get_argument("priority", 0))
+            species = yield self.application.branch.create_species(data, priority=priority)
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(dumps({"result": "error", "message": str(e)}))
+        else:
+            build = self.application.branch.builds.latest(species.id)
+            self.finish(dumps({"result": "success", "message": "OK", "build": build.id}))
+
+
+class SpeciesRollbackHandler(web.RequestHandler):
+
+    """Выполняет откат вида к предыдущей версии."""
+
+    @gen.coroutine
+    @token_auth
+    def post(self, _id):
+        """Делает предыдущую версию вида текущей и перезапускает его листья."""
+        _id = ObjectId(_id)
+
+        if _id not in self.application.branch.species:
+            self.set_status(404)
+            self.finish(dumps({"result": "error", "message": "Unknown species"}))
+        elif not self.application.branch.rollback_species(_id):
+            self.set_status(409)
+            self.finish(dumps({"result": "error", "message": "No previous version"}))
+        else:
+            self.finish(dumps({"result": "success", "versions": self.application.branch.species[_id].versions}))
+
 
-        self.finish(dumps({"result": "success", "message": "OK"}))
+class BuildListHandler(web.RequestHandler):
+
+    """Выполняет получение состояния очереди сборки видов."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self):
+        """Возвращает количество ожидающих и выполняющихся сборок и последние сборки."""
+        self.finish(dumps(self.application.branch.builds.stats))
+
+
+class BuildHandler(web.RequestHandler):
+
+    """Выполняет получение состояния сборки вида."""
+
+    @gen.coroutine
+    @token_auth
+    def get(self, build_id):
+        """Возвращает состояние указанной сборки."""
+        build = self.application.branch.builds.get(build_id)
+
+        if build:
+            self.finish(dumps(build.dict))
+        else:
+            self.set_status(404)
+            self.finish(dumps({"result": "error", "message": "Unknown build"}))
 
 
 class LoggerListHandler(web.RequestHandler):
@@ -0,0 +1,428 @@
+# coding=utf-8
+"""Модуль описывает кэш медиа-файлов листьев, хранящихся в GridFS."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import motor
+from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+
+from forest.components.common import log_message
+
+
+# pylint: disable=W0702
+
+
+class MediaCache(object):
+
+    """Двухуровневый LRU-кэш медиа-файлов GridFS.
+
+    Файлы хранятся на диске в пределах max_size байт, а небольшие файлы дополнительно держатся в памяти
+    в пределах memory_size байт. Файлы крупнее memory_item_size не загружаются в память целиком, а передаются
+    клиенту по частям как с диска, так и из GridFS. Ключ файла строится по его идентификатору в GridFS, длине и md5,
+    поэтому измененный файл получает новый ключ, а старая версия со временем вытесняется. Метаданные
+    файлов (соответствие имени и ключа) кэшируются на metadata_ttl секунд - это максимальное время,
+    в течение которого после изменения файла может отдаваться его прежняя версия.
+    """
+
+    METADATA_ITEMS = 100000
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(
+            self,
+            directory,
+            max_size=1024 ** 3,
+            memory_size=64 * 1024 ** 2,
+            memory_item_size=256 * 1024,
+            metadata_ttl=10
+    ):
+        """Инициализирует кэш и восстанавливает индекс файлов, уже сохраненных на диске.
+
+        :param directory: Директория кэша
+        :type directory: str
+        :param max_size: Максимальный размер кэша на диске в байтах
+        :type max_size: int
+        :param memory_size: Максимальный размер кэша в памяти в байтах; 0 отключает кэш в памяти
+        :type memory_size: int
+        :param memory_item_size: Максимальный размер файла, помещаемого в память, в байтах
+        :type memory_item_size: int
+        :param metadata_ttl: Время кэширования метаданных файлов в секундах
+        :type metadata_ttl: float
+        """
+        self.__directory__ = directory
+        self.__max_size__ = max_size
+        self.__memory_size__ = memory_size
+        self.__memory_item_size__ = memory_item_size
+        self.__metadata_ttl__ = metadata_ttl
+        self.__executor__ = ThreadPoolExecutor(2)
+
+        self.__disk__ = OrderedDict()
+        self.__disk_used__ = 0
+        self.__writing__ = set()
+        self.__memory__ = OrderedDict()
+        self.__memory_used__ = 0
+        self.__metadata__ = {}
+        self.__counters__ = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "not_found": 0,
+            "errors": 0,
+            "evictions": 0,
+            "bytes_served": 0,
+            "bytes_fetched": 0
+        }
+
+        if not os.path.exists(self.__directory__):
+            os.makedirs(self.__directory__)
+
+        entries = []
+        for name in os.listdir(self.__directory__):
+            path = os.path.join(self.__directory__, name)
+            if name.startswith("."):
+                os.remove(path)
+                continue
+
+            stat = os.stat(path)
+            entries.append((stat.st_atime, name, stat.st_size))
+
+        for atime, name, size in sorted(entries):
+            self.__disk__[name] = size
+            self.__disk_used__ += size
+
+        self.__evict__()
+
+    @staticmethod
+    def key(meta):
+        """Формирует ключ файла в кэше.
+
+        :param meta: Документ файла из коллекции fs.files
+        :type meta: dict
+        :returns: Ключ файла
+        :rtype: str
+        """
+        return "{}-{}-{}".format(meta["_id"], meta["length"], meta.get("md5", ""))
+
+    @property
+    def stats(self):
+        """Метрики кэша.
+
+        :returns: Словарь со счетчиками попаданий и промахов и занятым объемом
+        :rtype: dict
+        """
+        data = dict(self.__counters__)
+        requests = data["memory_hits"] + data["disk_hits"] + data["misses"]
+        data.update({
+            "hit_ratio": float(data["memory_hits"] + data["disk_hits"]) / requests if requests else None,
+            "disk": {"files": len(self.__disk__), "size": self.__disk_used__, "max_size": self.__max_size__},
+            "memory": {"files": len(self.__memory__), "size": self.__memory_used__, "max_size": self.__memory_size__},
+            "metadata": len(self.__metadata__)
+        })
+        return data
+
+    def invalidate(self, leaf_id=None):
+        """Сбрасывает кэшированные метаданные файлов, так что следующий запрос проверит их в GridFS.
+
+        :param leaf_id: Идентификатор листа; по умолчанию сбрасываются метаданные всех листьев
+        :type leaf_id: str
+        """
+        if leaf_id is None:
+            self.__metadata__.clear()
+        else:
+            for item in [_ for _ in self.__metadata__ if _[0] == leaf_id]:
+                del self.__metadata__[item]
+
+    @coroutine
+    def get(self, leaf_id, database, filename):
+        """Возвращает файл листа, при необходимости загружая его из GridFS.
+
+        Содержимое возвращается только для файлов не больше memory_item_size байт, более крупные файлы
+        передаются клиенту по частям методом stream.
+
+        :param leaf_id: Идентификатор листа
+        :type leaf_id: str
+        :param database: База данных листа
+        :type database: MotorDatabase
+        :param filename: Имя файла в GridFS
+        :type filename: str
+        :returns: Документ файла из fs.files и его содержимое (None для крупных файлов) или None, если файл
+            не найден
+        :rtype: tuple
+        """
+        try:
+            meta = yield self.__lookup__(leaf_id, database, filename)
+        except:
+            self.__counters__["errors"] += 1
+            raise
+
+        if not meta:
+            self.__counters__["not_found"] += 1
+            raise Return(None)
+
+        if meta["length"] > self.__memory_item_size__:
+            raise Return((meta, None))
+
+        key = self.key(meta)
+        data = self.__memory__.pop(key, None)
+
+        if data is not None:
+            self.__memory__[key] = data
+            self.__counters__["memory_hits"] += 1
+        elif key in self.__disk__:
+            self.__disk__[key] = self.__disk__.pop(key)
+            try:
+                data = yield self.__executor__.submit(self.__read__, key)
+            except (IOError, OSError):
+                self.__disk_used__ -= self.__disk__.pop(key, 0)
+            else:
+                self.__counters__["disk_hits"] += 1
+                self.__remember__(key, data)
+
+        if data is None:
+            try:
+                grid_out = yield motor.MotorGridFS(database).get(meta["_id"])
+                data = yield grid_out.read()
+            except:
+                self.__counters__["errors"] += 1
+                raise
+
+            self.__counters__["misses"] += 1
+            self.__counters__["bytes_fetched"] += len(data)
+            self.__remember__(key, data)
+            self.__store__(key, data)
+
+        self.__counters__["bytes_served"] += len(data)
+        raise Return((meta, data))
+
+    @coroutine
+    def stream(self, database, meta, write):
+        """Передает крупный файл по частям, не загружая его в память целиком.
+
+        Файл читается с диска, а при его отсутствии в кэше - из GridFS с одновременной записью на диск.
+        Следующая часть читается только после того, как write передаст предыдущую.
+
+        :param database: База данных листа
+        :type database: MotorDatabase
+        :param meta: Документ файла из fs.files, полученный методом get
+        :type meta: dict
+        :param write: Функция, передающая часть файла клиенту и возвращающая Future
+        :type write: function
+        """
+        key = self.key(meta)
+
+        if key in self.__disk__:
+            self.__disk__[key] = self.__disk__.pop(key)
+            try:
+                f = yield self.__executor__.submit(open, self.__path__(key), "rb")
+            except (IOError, OSError):
+                self.__disk_used__ -= self.__disk__.pop(key, 0)
+            else:
+                self.__counters__["disk_hits"] += 1
+                try:
+                    while True:
+                        chunk = yield self.__executor__.submit(f.read, self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+
+                        self.__counters__["bytes_served"] += len(chunk)
+                        yield write(chunk)
+                finally:
+                    self.__executor__.submit(f.close)
+
+                return
+
+        try:
+            grid_out = yield motor.MotorGridFS(database).get(meta["_id"])
+        except:
+            self.__counters__["errors"] += 1
+            raise
+
+        self.__counters__["misses"] += 1
+
+        tmp_path = os.path.join(self.__directory__, ".{}.tmp".format(key))
+        f = None
+
+        if meta["length"] <= self.__max_size__ and key not in self.__writing__:
+            try:
+                f = yield self.__executor__.submit(open, tmp_path, "wb")
+            except (IOError, OSError) as e:
+                log_message("Failed to cache media file {}: {}".format(key, e), "Branch")
+            else:
+                self.__writing__.add(key)
+
+        try:
+            while True:
+                try:
+                    chunk = yield grid_out.readchunk()
+                except:
+                    self.__counters__["errors"] += 1
+                    raise
+
+                if not chunk:
+                    break
+
+                self.__counters__["bytes_fetched"] += len(chunk)
+                self.__counters__["bytes_served"] += len(chunk)
+
+                if f:
+                    yield self.__executor__.submit(f.write, chunk)
+
+                yield write(chunk)
+        except:
+            if f:
+                self.__writing__.discard(key)
+                self.__executor__.submit(f.close)
+                self.__executor__.submit(os.remove, tmp_path)
+            raise
+
+        if f:
+            yield self.__executor__.submit(f.close)
+            future = self.__executor__.submit(os.rename, tmp_path, self.__path__(key))
+            IOLoop.current().add_future(future, lambda _: self.__stored__(key, meta["length"], _))
+
+    @coroutine
+    def __lookup__(self, leaf_id, database, filename):
+        """Возвращает метаданные последней версии файла, используя кэш метаданных.
+
+        :param leaf_id: Идентификатор листа
+        :type leaf_id: str
+        :param database: База данных листа
+        :type database: MotorDatabase
+        :param filename: Имя файла в GridFS
+        :type filename: str
+        :returns: Документ файла из fs.files или None
+        :rtype: dict
+        """
+        now = time.time()
+        cached = self.__metadata__.get((leaf_id, filename))
+
+        if cached and cached[0] > now:
+            raise Return(cached[1])
+
+        meta = yield database.fs.files.find_one({"filename": filename}, sort=[("uploadDate", -1)])
+
+        if len(self.__metadata__) >= self.METADATA_ITEMS:
+            for item in [_ for _, (expires, __) in self.__metadata__.items() if expires <= now]:
+                del self.__metadata__[item]
+
+            if len(self.__metadata__) >= self.METADATA_ITEMS:
+                self.__metadata__.clear()
+
+        self.__metadata__[(leaf_id, filename)] = (now + self.__metadata_ttl__, meta)
+
+        raise Return(meta)
+
+    def __remember__(self, key, data):
+        """Помещает файл в кэш в памяти, если он достаточно мал.
+
+        :param key: Ключ файла
+        :type key: str
+        :param data: Содержимое файла
+        :type data: bytes
+        """
+        if not self.__memory_size__ or len(data) > self.__memory_item_size__:
+            return
+
+        self.__memory__[key] = data
+        self.__memory_used__ += len(data)
+
+        while self.__memory_used__ > self.__memory_size__:
+            evicted_key, evicted = self.__memory__.popitem(last=False)
+            self.__memory_used__ -= len(evicted)
+
+    def __store__(self, key, data):
+        """Сохраняет файл на диск вне IOLoop.
+
+        Файл попадает в индекс только после завершения записи, поэтому чтение не может обогнать запись.
+
+        :param key: Ключ файла
+        :type key: str
+        :param data: Содержимое файла
+        :type data: bytes
+        """
+        if len(data) > self.__max_size__ or key in self.__disk__ or key in self.__writing__:
+            return
+
+        self.__writing__.add(key)
+        future = self.__executor__.submit(self.__write__, key, data)
+        IOLoop.current().add_future(future, lambda f: self.__stored__(key, len(data), f))
+
+    def __stored__(self, key, size, future):
+        """Добавляет записанный файл в индекс и вытесняет давно не использованные файлы.
+
+        :param key: Ключ файла
+        :type key: str
+        :param size: Размер файла
+        :type size: int
+        :param future: Результат записи
+        :type future: Future
+        """
+        self.__writing__.discard(key)
+
+        if future.exception():
+            log_message("Failed to cache media file {}: {}".format(key, future.exception()), "Branch")
+            return
+
+        self.__disk__[key] = size
+        self.__disk_used__ += size
+        self.__evict__()
+
+    def __evict__(self):
+        """Удаляет с диска давно не использованные файлы, пока кэш превышает допустимый размер."""
+        while self.__disk_used__ > self.__max_size__ and self.__disk__:
+            key, size = self.__disk__.popitem(last=False)
+            self.__disk_used__ -= size
+            self.__counters__["evictions"] += 1
+            self.__executor__.submit(self.__remove__, key)
+
+    def __path__(self, key):
+        """Возвращает путь к файлу кэша.
+
+        :param key: Ключ файла
+        :type key: str
+        :returns: Полный путь к файлу
+        :rtype: str
+        """
+        return os.path.join(self.__directory__, key)
+
+    def __read__(self, key):
+        """Читает файл кэша. Метод вызывается в потоке.
+
+        :param key: Ключ файла
+        :type key: str
+        :returns: Содержимое файла
+        :rtype: bytes
+        """
+        with open(self.__path__(key), "rb") as f:
+            return f.read()
+
+    def __write__(self, key, data):
+        """Атомарно записывает файл кэша. Метод вызывается в потоке.
+
+        :param key: Ключ файла
+        :type key: str
+        :param data: Содержимое файла
+        :type data: bytes
+        """
+        tmp_path = os.path.join(self.__directory__, ".{}.tmp".format(key))
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        os.rename(tmp_path, self.__path__(key))
+
+    def __remove__(self, key):
+        """Удаляет файл кэша. Метод вызывается в потоке.
+
+        :param key: Ключ файла
+        :type key: str
+        """
+        try:
+            os.remove(self.__path__(key))
+        except OSError:
+            pass
@@ -6,8 +6,11 @@
 from __future__ import print_function, unicode_literals
 
 import datetime
+import time
 import traceback
-from collections import defaultdict
+from collections import defaultdict, deque
+from fnmatch import fnmatch
+from StringIO import StringIO
 import os
 
 from zmq.eventloop.zmqstream import ZMQStream
@@ -16,12 +19,24 @@ from tornado.ioloop import IOLoop
 import simplejson as json
 import ConfigParser
 import zmq
+from toro import Condition, Semaphore
 
 from forest.components.common import log_message
+from forest.components.environments import EnvironmentStore
+from forest.components.database import get_connection_async
 
+from forest.components.branch.buildqueue import BuildQueue
+from forest.components.branch.mediacache import MediaCache
+from forest.components.branch.snapshot import StateSnapshot
 from forest.components.leaf import Leaf
+from forest.components.lifecycle import QUEUED, PAUSED
+from forest.components.mirrors import MirrorCache
 from forest.components.logparse import logparse
-from forest.components.species import Species
+from forest.components.metrics import Histogram
+from forest.components.registry import VassalRegistry
+from forest.components.rpc import RPCClient
+from forest.components.species import Species, VERSION_SLOTS
+from forest.components.wheelhouse import Wheelhouse
 from forest.components.common import loads, load
 from forest.components.branch.loggers import Logger, POSTLogger
 
@@ -29,6 +44,9 @@ from forest.components.branch.loggers import Logger, POSTLogger
 # pylint: disable=W0702,W0612,W0613
 
 
+BUILD_EVENTS_QUEUE = 10000
+
+
 class Branch(object):
 
     """Класс ветви, служащий для запуска приложений и логгирования их работы."""
@@ -45,8 +63,46 @@ class Branch(object):
         self.trunk = trunk
 
         self.leaves = {}
+        self.__addresses__ = {}
+        self.__media_databases__ = {}
+        self.media_cache = None
+        self.__media_proxy__ = None
+
+        media_settings = dict(settings.get("media_cache") or {})
+        if media_settings:
+            self.__media_proxy__ = media_settings.pop("address")
+            media_settings.setdefault("directory", os.path.join(self.trunk.forest_root, "media_cache"))
+            self.media_cache = MediaCache(**media_settings)
+
+        self.wheelhouse = None
+        wheelhouse_settings = settings.get("wheelhouse", {})
+        if wheelhouse_settings is not False:
+            wheelhouse_settings = dict(wheelhouse_settings or {})
+            wheelhouse_settings.setdefault("directory", os.path.join(self.trunk.forest_root, "wheelhouse"))
+            self.wheelhouse = Wheelhouse(**wheelhouse_settings)
+
+        self.environments = None
+        if settings.get("shared_environments", True):
+            self.environments = EnvironmentStore(os.path.join(self.trunk.forest_root, "environments"))
+
+        self.mirrors = None
+        if settings.get("source_mirrors", True):
+            self.mirrors = MirrorCache(os.path.join(self.trunk.forest_root, "mirrors"))
+
         self.species = {}
+        build_settings = dict(settings.get("builds") or {})
+        self.__step_timeout__ = build_settings.pop("step_timeout", 1800)
+        self.__compile_processes__ = build_settings.pop("compile_processes", None)
+        self.builds = BuildQueue(**build_settings)
+        self.cold_starts = {
+            "species": defaultdict(Histogram),
+            "leaves": defaultdict(Histogram)
+        }
         self.__loggers__ = []
+        self.__build_events__ = deque(maxlen=BUILD_EVENTS_QUEUE)
+        self.__build_events_dropped__ = 0
+        self.__build_events_condition__ = Condition()
+        IOLoop.current().spawn_callback(self.__send_build_events__)
 
         for logger in settings.get("loggers", []):
             try:
@@ -63,32 +119,74 @@ class Branch(object):
         self.stream.on_recv(self.log_message)
         log_message("Started branch", component="Branch")
 
+        self.snapshot = StateSnapshot(os.path.join(self.trunk.forest_root, "branch_state.json"), self.__state__)
+        self.restore_stats = None
+
         IOLoop.current().spawn_callback(self.__restore_species__)
 
     @coroutine
     def __restore_species__(self):
-        """Выполняет восстановление видов после перезагрузки."""
+        """Выполняет восстановление видов после перезагрузки.
+
+        Данные вида берутся из снимка состояния, если файл метаданных вида не изменялся после записи
+        снимка, иначе считывается файл метаданных. Сам вид файл метаданных не читает и не перезаписывает.
+        """
+        started = time.time()
+        snapshot = self.snapshot.load() or {}
+        stats = {"species": 0, "leaves": 0, "snapshot": bool(snapshot), "from_snapshot": 0}
+
         try:
             for species_id in os.listdir(self.species_dir):
-                if os.path.isdir(os.path.join(self.species_dir, species_id)):
-                    try:
-                        with open(os.path.join(self.species_dir, species_id, "metadata.json"), "r") as m:
-                            yield self.create_species(load(m), initialize=False)
-                    except (TypeError, ValueError, IOError):
-                        pass
+                metadata = os.path.join(self.species_dir, species_id, "metadata.json")
+                entry = snapshot.get("species", {}).get(species_id)
+
+                try:
+                    mtime = os.stat(metadata).st_mtime
+
+                    if isinstance(entry, dict) and isinstance(entry.get("data"), dict) and \
+                            entry.get("mtime") == mtime:
+                        data = entry["data"]
+                        stats["from_snapshot"] += 1
+                    else:
+                        with open(metadata, "r") as m:
+                            data = load(m)
+
+                    yield self.create_species(data, initialize=False, metadata_mtime=mtime)
+                    stats["species"] += 1
+                except (KeyError, TypeError, ValueError, IOError, OSError):
+                    pass
         except OSError:
             pass
 
-        IOLoop.current().spawn_callback(self.__restore_leaves__)
+        IOLoop.current().spawn_callback(self.__restore_leaves__, snapshot, started, stats)
 
     @coroutine
-    def __restore_leaves__(self):
-        """Выполняет восстановление листьев после перезагрузки."""
-        for leaf_config in os.listdir(self.trunk.emperor.vassal_dir):
-            config = ConfigParser.ConfigParser()
-            config.read(os.path.join(self.trunk.emperor.vassal_dir, leaf_config))
+    def __restore_leaves__(self, snapshot, started, stats):
+        """Выполняет восстановление листьев после перезагрузки.
+
+        Данные листа берутся из снимка состояния, если конфигурация его вассала не изменилась после
+        записи снимка, иначе они извлекаются из конфигурации вассала.
+
+        :param snapshot: Снимок состояния ветви
+        :type snapshot: dict
+        :param started: Время начала восстановления
+        :type started: float
+        :param stats: Счетчики восстановления
+        :type stats: dict
+        """
+        for leaf_name in self.trunk.emperor.vassal_names:
+            entry = snapshot.get("leaves", {}).get(leaf_name)
+            leaf = None
+
             try:
-                data = loads(config.get("forest", "data"))
+                if isinstance(entry, dict) and isinstance(entry.get("data"), dict) and \
+                        entry.get("fingerprint") == self.trunk.emperor.vassal_fingerprint(leaf_name):
+                    data = entry["data"]
+                    stats["from_snapshot"] += 1
+                else:
+                    config = ConfigParser.ConfigParser()
+                    config.readfp(StringIO(self.trunk.emperor.vassal_config(leaf_name) or ""))
+                    data = loads(config.get("forest", "data"))
 
                 if data.get("cls") != "Leaf":
                     continue
@@ -101,9 +199,59 @@ class Branch(object):
                 if leaf:
                     log_message("Restoring leaf {}".format(leaf.id), component="Branch")
                     self.add_leaf(leaf, start=False)
-            except (ConfigParser.NoSectionError, ConfigParser.NoOptionError, Species.NotDefined):
+                    stats["leaves"] += 1
+            except (
+                KeyError, TypeError, AttributeError, ConfigParser.NoSectionError, ConfigParser.NoOptionError,
+                Species.NotDefined
+            ):
+                continue
+
+        stats["duration"] = time.time() - started
+        self.restore_stats = stats
+        self.snapshot.schedule()
+
+        log_message(
+            "Restored {species} species and {leaves} leaves in {duration:.3f}s, "
+            "{from_snapshot} from state snapshot".format(**stats),
+            component="Branch"
+        )
+
+    def __state__(self):
+        """Формирует состояние ветви для снимка.
+
+        Вид попадает в снимок вместе со временем модификации своего файла метаданных, лист - вместе с
+        отпечатком конфигурации вассала. Лист, конфигурация которого еще не записана, в снимок не
+        попадает, а запись снимка повторяется позже.
+
+        :returns: Словарь видов и листьев по идентификаторам
+        :rtype: dict
+        """
+        leaves = {}
+        pending = False
+
+        for leaf in self.leaves.values():
+            fingerprint = self.trunk.emperor.vassal_fingerprint(leaf.id)
+
+            if fingerprint is None:
+                continue
+
+            if fingerprint != VassalRegistry.fingerprint(leaf.get_config()):
+                pending = True
                 continue
 
+            leaves[leaf.id] = {"data": leaf.dict, "fingerprint": fingerprint}
+
+        if pending:
+            self.snapshot.schedule(10)
+
+        return {
+            "species": {
+                str(species.id): {"data": species.metadata, "mtime": species.metadata_mtime}
+                for species in self.species.values()
+            },
+            "leaves": leaves
+        }
+
     @property
     def species_dir(self):
         """Генерирует полный путь к директории видов.
@@ -135,25 +283,99 @@ class Branch(object):
                         data_parsed[key] = int(data_parsed[key])
 
                 data_parsed["log_type"] = "leaf.event"
+
+                leaf = self.leaves.get(str(data_parsed.get("log_source")))
+                if leaf:
+                    leaf.log_request()
             except json.JSONDecodeError:
                 data_parsed = logparse(data)
                 data_parsed["time"] = datetime.datetime.utcnow()
 
-            data_parsed.update({
-                "component_name": self.trunk.name,
-                "component_type": "branch"
-            })
+                leaf = self.leaves.get(str(data_parsed.get("log_source")))
+                if leaf and "raw" in data_parsed:
+                    leaf.log_output(data_parsed["raw"])
 
-            try:
-                yield [logger.log(data_parsed) for logger in self.__loggers__ if logger.suitable(data_parsed)]
-            except:
-                traceback.print_exc()
+            yield self.log_event(data_parsed)
+
+    @coroutine
+    def log_event(self, data):
+        """Передает событие логгерам ветви, дополняя его информацией о компоненте.
+
+        :param data: Событие
+        :type data: dict
+        """
+        data.update({
+            "component_name": self.trunk.name,
+            "component_type": "branch"
+        })
+
+        try:
+            yield [logger.log(data) for logger in self.__loggers__ if logger.suitable(data)]
+        except:
+            traceback.print_exc()
 
         failed_loggers = [logger for logger in self.__loggers__ if logger.failed]
 
         for logger in failed_loggers:
             self.__loggers__.remove(logger)
 
+    def log_build_event(self, event):
+        """Ставит событие сборки вида в очередь передачи логгерам.
+
+        Очередь ограничена BUILD_EVENTS_QUEUE событиями; при переполнении отбрасываются самые старые.
+
+        :param event: Событие сборки (см. Species.run_in_env)
+        :type event: dict
+        """
+        event.update({
+            "log_type": "species.build",
+            "time": datetime.datetime.utcnow()
+        })
+
+        if len(self.__build_events__) == self.__build_events__.maxlen:
+            self.__build_events_dropped__ += 1
+
+        self.__build_events__.append(event)
+        self.__build_events_condition__.notify_all()
+
+    @coroutine
+    def __send_build_events__(self):
+        """Передает логгерам события сборки из очереди.
+
+        События передаются по одному, так что одновременно выполняется не больше одной передачи.
+        Строки вывода одного потока одного шага, накопившиеся в очереди за время передачи, объединяются
+        в одно событие output, в котором lines - количество строк.
+        """
+        while True:
+            if not self.__build_events__:
+                yield self.__build_events_condition__.wait()
+                continue
+
+            if self.__build_events_dropped__:
+                log_message(
+                    "Dropped {} build events, loggers are too slow".format(self.__build_events_dropped__),
+                    component="Branch"
+                )
+                self.__build_events_dropped__ = 0
+
+            batch = []
+            while self.__build_events__:
+                event = self.__build_events__.popleft()
+                last = batch[-1] if batch else None
+
+                if event["event"] == "output" and last and last["event"] == "output" and all(
+                    last.get(key) == event.get(key) for key in ("species", "step", "stream")
+                ):
+                    last["message"] += "\n" + event["message"]
+                    last["lines"] += 1
+                else:
+                    if event["event"] == "output":
+                        event["lines"] = 1
+                    batch.append(event)
+
+            for event in batch:
+                yield self.log_event(event)
+
     def add_logger(self, configuration):
         """Добавляет логгер заданной конфигурации.
 
@@ -192,15 +414,28 @@ class Branch(object):
             return True, 200, "OK"
 
     @coroutine
-    def create_species(self, species, initialize=True):
+    def create_species(self, species, initialize=True, priority=0, metadata_mtime=None):
         """Создает вид листа по данным из словаря.
 
+        Инициализация вида не выполняется сразу, а ставится в очередь сборки (см. Branch.builds).
+
         :rtype : Species
         :param species: словарь с данными конфигурации вида
+        :param initialize: Ставить ли вид в очередь сборки
+        :param priority: Приоритет сборки вида
+        :param metadata_mtime: Время модификации файла метаданных, из которого восстанавливается вид
         :return: Созданный экземпляр вида листа
         """
         species = Species(
             directory=os.path.join(self.trunk.forest_root, "species"),
+            wheelhouse=self.wheelhouse,
+            environments=self.environments,
+            mirrors=self.mirrors,
+            on_build_event=self.log_build_event,
+            step_timeout=self.__step_timeout__,
+            compile_processes=self.__compile_processes__,
+            metadata_mtime=metadata_mtime,
+            versions_in_use=self.versions_in_use,
             **species
         )
 
@@ -211,23 +446,85 @@ class Branch(object):
         else:
             log_message("Restoring species {}".format(species.id), component="Branch")
 
-        self.species[species.id] = species
+        if not initialize or species.id not in self.species:
+            self.species[species.id] = species
+            self.snapshot.schedule()
 
         if initialize:
+            build = self.builds.submit(species.id, species.modified, lambda: self.__build_species__(species), priority)
+            log_message("Species {} queued for build {}".format(species.id, build.id), component="Branch")
+
+        raise Return(species)
 
-            species.is_ready = False
-            for leaf in (_ for _ in self.leaves.values() if _.species.id == species.id):
-                leaf.species = species
-                leaf.pause()
+    @coroutine
+    def __build_species__(self, species):
+        """Собирает новую версию вида и переключает на нее листья.
+
+        Пока версия собирается, листья продолжают работать с текущей версией вида.
 
-            yield species.initialize()
+        :param species: Собираемый вид
+        :type species: Species
+        """
+        yield species.initialize()
 
-            species.is_ready = True
-            for leaf in (_ for _ in self.leaves.values() if _.species.id == species.id):
-                leaf.species = species
+        species.is_ready = True
+        self.species[species.id] = species
+        self.__switch_species__(species)
+        self.snapshot.schedule()
+
+    def __switch_species__(self, species):
+        """Переводит листья вида на его текущую версию.
+
+        Ожидающие сборки листья запускаются, работающие - плавно перезапускаются. Запуски и перезапуски
+        проходят через планировщик запуска вассалов, поэтому листья вида перезапускаются не все сразу.
+
+        :param species: Вид
+        :type species: Species
+        """
+        for leaf in (_ for _ in self.leaves.values() if _.species.id == species.id):
+            leaf.species = species
+
+            if leaf.status in (QUEUED, PAUSED):
                 leaf.start()
+            else:
+                self.trunk.emperor.reload_vassal(leaf)
 
-        raise Return(species)
+    def versions_in_use(self, species):
+        """Возвращает версии вида, на которые ссылаются записанные конфигурации его листьев.
+
+        Конфигурация листа содержит путь к конкретной версии вида (см. Species.version_path), а в реестре
+        вассалов она заменяется только после допуска перезапуска планировщиком. Пока лист не перезапущен
+        с новой конфигурацией, его воркеры работают с прежней версией, и ее слот нельзя использовать для сборки.
+
+        :param species: Вид
+        :type species: Species
+        :returns: Множество путей версий относительно корневой директории вида
+        :rtype: set
+        """
+        versions = [os.path.join("versions", slot) for slot in VERSION_SLOTS]
+        used = set()
+
+        for leaf in (_ for _ in self.leaves.values() if _.species.id == species.id):
+            config = self.trunk.emperor.vassal_config(leaf.id) or ""
+            used.update(_ for _ in versions if os.path.join(species.path, _, "") in config)
+
+        return used
+
+    def rollback_species(self, species_id):
+        """Возвращает вид к предыдущей версии и перезапускает его листья.
+
+        :param species_id: Идентификатор вида
+        :type species_id: ObjectId
+        :returns: Флаг выполнения отката
+        :rtype: bool
+        """
+        species = self.species.get(species_id)
+
+        if not species or not species.rollback():
+            return False
+
+        self.__switch_species__(species)
+        return True
 
     def create_leaf(self, **leaf):
         """Создает экземпляр листа.
@@ -247,12 +544,50 @@ class Branch(object):
             species=species,
             log_port=5122,
             leaf_host=self.__host__,
+            on_cold_start=self.record_cold_start,
+            media_proxy=self.__media_proxy__,
             **leaf
         )
 
+    def record_cold_start(self, leaf, duration):
+        """Учитывает длительность запуска листа.
+
+        Запуском считается как время от записи конфигурации до готовности к приему запросов, так и время
+        выхода листа из экономного режима до первого ответа.
+
+        :param leaf: Запущенный лист
+        :type leaf: Leaf
+        :param duration: Длительность запуска в секундах
+        :type duration: float
+        """
+        self.cold_starts["species"][str(leaf.species.id)].add(duration)
+        self.cold_starts["leaves"][leaf.id].add(duration)
+
+    def cold_start_summary(self, species_id=None):
+        """Возвращает перцентили длительности запуска по видам и листьям.
+
+        :param species_id: Идентификатор вида для фильтрации
+        :type species_id: str
+        :returns: Словарь с описанием гистограмм видов и листьев
+        :rtype: dict
+        """
+        leaves = dict(
+            (leaf_id, histogram.summary) for leaf_id, histogram in self.cold_starts["leaves"].items()
+            if not species_id or (leaf_id in self.leaves and str(self.leaves[leaf_id].species.id) == species_id)
+        )
+        species = dict(
+            (_id, histogram.summary) for _id, histogram in self.cold_starts["species"].items()
+            if not species_id or _id == species_id
+        )
+
+        return {"species": species, "leaves": leaves}
+
     def add_leaf(self, leaf, start=True):
         """Добавляет лист на ветвь.
 
+        Если лист с таким идентификатором уже есть на ветви, новый экземпляр наследует его состояние,
+        а перезапуск выполняется только при изменении конфигурации.
+
         :param leaf: Лист
         :type leaf: Leaf
         :param start: Флаг запуска
@@ -260,16 +595,119 @@ class Branch(object):
         :returns: Результат запуска
         :rtype: bool
         """
-        if leaf.id in self.leaves:
-            self.leaves[leaf.id].stop()
-            del self.leaves[leaf.id]
+        previous = self.leaves.get(leaf.id)
+
+        if previous:
+            leaf.inherit(previous)
+            self.__forget_addresses__(previous)
 
         self.leaves[leaf.id] = leaf
+        self.__addresses__.update((address, leaf.id) for address in leaf.address or [])
+        self.snapshot.schedule()
         if start:
             return leaf.start()
         else:
+            if previous:
+                previous.stop()
             return None
 
+    def select_leaves(self, leaf_ids=None, species_id=None, address=None):
+        """Выбирает листья ветви, подходящие под фильтр.
+
+        :param leaf_ids: Идентификаторы листьев; по умолчанию - все листья
+        :type leaf_ids: list
+        :param species_id: Идентификатор вида листьев
+        :type species_id: str
+        :param address: Шаблон адреса листа в формате fnmatch
+        :type address: str
+        :returns: Список листьев
+        :rtype: list
+        """
+        if leaf_ids:
+            leaves = [self.leaves[_] for _ in set(leaf_ids) if _ in self.leaves]
+        else:
+            leaves = list(self.leaves.values())
+
+        if species_id:
+            leaves = [_ for _ in leaves if str(_.species.id) == str(species_id)]
+
+        if address:
+            leaves = [_ for _ in leaves if any(fnmatch(a, address) for a in _.address or [])]
+
+        return leaves
+
+    @coroutine
+    def leaves_status(self, leaf_ids=None, species_id=None, max_staleness=None):
+        """Возвращает статус листьев ветви, построенный по одному снимку статистики uwsgi-emperor.
+
+        :param leaf_ids: Идентификаторы интересующих листьев; по умолчанию - все листья
+        :type leaf_ids: list
+        :param species_id: Идентификатор вида для фильтрации листьев
+        :type species_id: str
+        :param max_staleness: Максимально допустимый возраст снимка статистики в секундах
+        :type max_staleness: float
+        :returns: Словарь статусов листьев, индексированный по их идентификаторам
+        :rtype: dict
+        """
+        snapshot = yield self.trunk.emperor.stats_snapshot(max_staleness)
+
+        result = {}
+        for leaf in self.select_leaves(leaf_ids=leaf_ids, species_id=species_id):
+            stats = snapshot.get(leaf.id, {})
+            result[leaf.id] = {
+                "status": leaf.status,
+                "species": leaf.species.id,
+                "pid": stats.get("pid"),
+                "respawns": stats.get("respawns"),
+                "ready": bool(stats.get("ready")),
+                "accepting": bool(stats.get("accepting")),
+                "dormant": leaf.dormant,
+                "lifecycle": leaf.lifecycle.summary
+            }
+
+        raise Return(result)
+
+    @coroutine
+    def broadcast_rpc(self, args, leaf_ids=None, species_id=None, address=None, parallelism=10, timeout=None):
+        """Вызывает rpc-функцию на всех листьях, подходящих под фильтр.
+
+        Вызовы выполняются параллельно, но не более parallelism одновременно.
+
+        :param args: Имя функции и ее аргументы
+        :type args: list
+        :param leaf_ids: Идентификаторы листьев
+        :type leaf_ids: list
+        :param species_id: Идентификатор вида листьев
+        :type species_id: str
+        :param address: Шаблон адреса листа в формате fnmatch
+        :type address: str
+        :param parallelism: Максимальное количество одновременных вызовов
+        :type parallelism: int
+        :param timeout: Таймаут каждого вызова в секундах
+        :type timeout: float
+        :returns: Результаты вызова, индексированные по идентификаторам листьев
+        :rtype: dict
+        :raise ValueError: Аргументы не помещаются в пакет uwsgi-rpc
+        """
+        RPCClient.pack(args)
+
+        semaphore = Semaphore(max(1, parallelism))
+
+        @coroutine
+        def call(leaf):
+            """Выполняет вызов на одном листе с учетом ограничения параллельности."""
+            with (yield semaphore.acquire()):
+                started = time.time()
+                response = yield self.trunk.emperor.call_vassal_rpc(leaf.id, *args, timeout=timeout)
+                response["time"] = time.time() - started
+
+            raise Return((leaf.id, response))
+
+        leaves = self.select_leaves(leaf_ids=leaf_ids, species_id=species_id, address=address)
+        results = yield [call(leaf) for leaf in leaves]
+
+        raise Return(dict(results))
+
     def del_leaf(self, leaf):
         """Удаляет лист с ветви.
 
@@ -278,4 +716,58 @@ class Branch(object):
         """
         leaf.stop()
         if leaf.id in self.leaves:
+            self.__forget_addresses__(self.leaves[leaf.id])
             del self.leaves[leaf.id]
+            self.snapshot.schedule()
+
+        self.__media_databases__.pop(leaf.id, None)
+        self.cold_starts["leaves"].pop(leaf.id, None)
+
+    def __forget_addresses__(self, leaf):
+        """Удаляет адреса листа из индекса адресов.
+
+        :param leaf: Лист
+        :type leaf: Leaf
+        """
+        for address in leaf.address or []:
+            if self.__addresses__.get(address) == leaf.id:
+                del self.__addresses__[address]
+
+    def leaf_by_address(self, address):
+        """Возвращает лист, обслуживающий указанный адрес.
+
+        :param address: Адрес (хост) листа
+        :type address: str
+        :returns: Лист или None
+        :rtype: Leaf
+        """
+        return self.leaves.get(self.__addresses__.get(address))
+
+    def media_database(self, leaf):
+        """Возвращает подключение к базе MongoDB листа, в которой хранятся медиа-файлы.
+
+        Подключения переиспользуются, пока не изменятся настройки базы листа.
+
+        :param leaf: Лист
+        :type leaf: Leaf
+        :returns: База данных листа или None, если лист не использует MongoDB
+        :rtype: MotorDatabase
+        """
+        mongo = (leaf.batteries or {}).get("mongo")
+        if not mongo:
+            return None
+
+        settings = (mongo["host"], mongo["port"], mongo["name"], mongo["user"], mongo["pass"])
+        cached = self.__media_databases__.get(leaf.id)
+
+        if not cached or cached[0] != settings:
+            cached = self.__media_databases__[leaf.id] = (settings, get_connection_async(
+                host=mongo["host"],
+                port=mongo["port"],
+                database=mongo["name"],
+                user=mongo["user"],
+                password=mongo["pass"],
+                replica="forest"
+            ))
+
+        return cached[1]
@@ -0,0 +1,93 @@
+# coding=utf-8
+"""Модуль описывает снимок состояния ветви, используемый для быстрого восстановления после перезапуска."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+
+from simplejson import JSONDecodeError
+from tornado.ioloop import IOLoop
+
+from forest.components.common import log_message, dump, load
+
+
+class StateSnapshot(object):
+
+    """Файл с компактным описанием видов и листьев ветви.
+
+    Снимок записывается целиком через временный файл и переименование, поэтому при чтении он либо
+    отсутствует, либо полностью соответствует одному из записанных состояний. Изменения, поступившие
+    в течение delay секунд, объединяются в одну запись. Снимок другой версии формата не загружается.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, state, delay=1.0):
+        """Инициализирует снимок.
+
+        :param path: Путь к файлу снимка
+        :type path: str
+        :param state: Функция, возвращающая текущее состояние ветви
+        :type state: function
+        :param delay: Окно объединения изменений в секундах
+        :type delay: float
+        """
+        self.__path__ = path
+        self.__state__ = state
+        self.__delay__ = delay
+        self.__timeout__ = None
+
+    def load(self):
+        """Загружает снимок.
+
+        :returns: Состояние ветви или None, если снимок отсутствует, поврежден или имеет другую версию
+        :rtype: dict
+        """
+        try:
+            with open(self.__path__, "r") as f:
+                snapshot = load(f)
+        except (IOError, ValueError, JSONDecodeError):
+            return None
+
+        if not isinstance(snapshot, dict) or snapshot.get("version") != self.VERSION:
+            return None
+
+        if not isinstance(snapshot.get("species"), dict) or not isinstance(snapshot.get("leaves"), dict):
+            return None
+
+        return snapshot
+
+    def schedule(self, delay=None):
+        """Планирует запись снимка.
+
+        :param delay: Задержка записи в секундах; по умолчанию используется окно объединения изменений
+        :type delay: float
+        """
+        if self.__timeout__ is None:
+            self.__timeout__ = IOLoop.current().call_later(
+                self.__delay__ if delay is None else delay, self.write
+            )
+
+    def write(self):
+        """Записывает снимок текущего состояния ветви.
+
+        :returns: Флаг успешной записи
+        :rtype: bool
+        """
+        if self.__timeout__ is not None:
+            IOLoop.current().remove_timeout(self.__timeout__)
+            self.__timeout__ = None
+
+        snapshot = dict(self.__state__(), version=self.VERSION)
+        tmp_path = "{}.tmp".format(self.__path__)
+
+        try:
+            with open(tmp_path, "w") as f:
+                dump(snapshot, f)
+
+            os.rename(tmp_path, self.__path__)
+        except (IOError, OSError) as e:
+            log_message("Failed to write state snapshot: {}".format(e), "Branch")
+            return False
+
+        return True
@@ -3,11 +3,14 @@
 
 from __future__ import print_function, unicode_literals
 
+import os
 from datetime import datetime
 
 import simplejson
 from tornado.httpclient import AsyncHTTPClient, HTTPError
-from tornado.gen import coroutine, Return
+from tornado.gen import coroutine, Return, with_timeout, TimeoutError
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 from bson import json_util
 
 
@@ -69,6 +72,51 @@ def dump(data, fp):
     return simplejson.dump(data, fp, default=json_util.default)
 
 
+def replace_symlink(target, path):
+    """Атомарно создает или заменяет символическую ссылку.
+
+    :param target: Путь, на который указывает ссылка
+    :type target: str
+    :param path: Путь к ссылке
+    :type path: str
+    """
+    tmp_path = "{}.tmp".format(path)
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    os.symlink(target, tmp_path)
+    os.rename(tmp_path, path)
+
+
+@coroutine
+def connect(tcp_client, host, port, deadline):
+    """Открывает TCP-соединение, ограничивая время подключения.
+
+    Соединение, установленное уже после истечения deadline, сразу закрывается.
+
+    :param tcp_client: Используемый для подключения TCPClient
+    :type tcp_client: TCPClient
+    :param host: Хост
+    :type host: str
+    :param port: Порт
+    :type port: int
+    :param deadline: Время IOLoop, до которого должно быть установлено соединение
+    :type deadline: float
+    :returns: Открытое соединение
+    :rtype: IOStream
+    :raise TimeoutError: Соединение не установлено до deadline
+    """
+    future = tcp_client.connect(host, port)
+
+    try:
+        stream = yield with_timeout(deadline, future, quiet_exceptions=(StreamClosedError, IOError))
+    except TimeoutError:
+        IOLoop.current().add_future(future, lambda f: f.exception() is None and f.result().close())
+        raise
+
+    raise Return(stream)
+
+
 @coroutine
 def send_request(host, resource, method, data=None):
     """Асинхронно отправляет запрос.
@@ -0,0 +1,274 @@
+# coding=utf-8
+"""Модуль описывает классы, записывающие и публикующие конфигурации вассалов."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import zmq
+from tornado.ioloop import IOLoop
+from zmq.eventloop.zmqstream import ZMQStream
+
+from forest.components.common import log_message
+from forest.components.registry import VassalRegistry
+
+
+class VassalConfigWriter(object):
+
+    """Записывает конфигурационные файлы вассалов вне IOLoop.
+
+    Для каждого вассала в реестре хранится отпечаток последней записанной конфигурации, поэтому неизменившаяся
+    конфигурация не затрагивает диск. Изменения, поступившие в течение короткого окна, объединяются
+    в одну запись. Запись выполняется через временный файл и переименование, так что монитор
+    uwsgi-emperor никогда не видит частично записанный файл. Все операции выполняются в одном
+    потоке, чтобы удаление не могло обогнать предшествующую запись того же вассала.
+    """
+
+    def __init__(self, directory, delay=0.05, extension=".ini", registry=None):
+        """Инициализирует объект.
+
+        :param directory: Директория конфигурационных файлов
+        :type directory: str
+        :param delay: Окно объединения изменений одного вассала в секундах
+        :type delay: float
+        :param extension: Расширение конфигурационных файлов
+        :type extension: str
+        :param registry: Реестр конфигураций, в котором хранятся отпечатки; если не указан, создается
+                         реестр без отслеживания директории
+        :type registry: VassalRegistry
+        """
+        self.__directory__ = directory
+        self.__delay__ = delay
+        self.__extension__ = extension
+        self.__registry__ = registry or VassalRegistry(directory, extension=extension, watch=False)
+        self.__pending__ = {}
+        self.__timeouts__ = {}
+        self.__executor__ = ThreadPoolExecutor(1)
+
+    def __contains__(self, name):
+        """Проверяет, известна ли конфигурация вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :rtype: bool
+        """
+        return name in self.__registry__
+
+    @property
+    def registry(self):
+        """Реестр конфигураций вассалов.
+
+        :rtype: VassalRegistry
+        """
+        return self.__registry__
+
+    def path(self, name):
+        """Возвращает путь к конфигурационному файлу вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Полный путь к конфигурационному файлу
+        :rtype: str
+        """
+        return os.path.join(self.__directory__, "{}{}".format(name, self.__extension__))
+
+    def changed(self, name, config):
+        """Проверяет, отличается ли конфигурация от последней записанной.
+
+        :param name: Имя вассала
+        :type name: str
+        :param config: Конфигурация вассала
+        :type config: str
+        :rtype: bool
+        """
+        return self.__registry__.get_fingerprint(name) != VassalRegistry.fingerprint(config)
+
+    def write(self, name, config):
+        """Планирует запись конфигурации вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :param config: Конфигурация вассала
+        :type config: str
+        :returns: Флаг изменения конфигурации
+        :rtype: bool
+        """
+        if not self.changed(name, config):
+            return False
+
+        self.__registry__.set(name, config)
+        self.__schedule__(name, ("write", config))
+        return True
+
+    def remove(self, name):
+        """Планирует удаление конфигурации вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        self.__registry__.discard(name)
+        self.__schedule__(name, ("remove", None))
+
+    def touch(self, name):
+        """Планирует обновление времени модификации конфигурации, что приводит к плавному перезапуску вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        if name not in self.__registry__ or name in self.__pending__:
+            # Запланированная запись и так приведет к перезапуску
+            return
+
+        self.__schedule__(name, ("touch", None))
+
+    def cancel(self):
+        """Отменяет все запланированные операции."""
+        for timeout in self.__timeouts__.values():
+            IOLoop.current().remove_timeout(timeout)
+
+        self.__timeouts__.clear()
+        self.__pending__.clear()
+
+    def __schedule__(self, name, operation):
+        """Ставит операцию над вассалом в очередь, заменяя предыдущую запланированную операцию.
+
+        :param name: Имя вассала
+        :type name: str
+        :param operation: Действие и его данные
+        :type operation: tuple
+        """
+        self.__pending__[name] = operation
+
+        if name not in self.__timeouts__:
+            self.__timeouts__[name] = IOLoop.current().call_later(self.__delay__, self.__flush__, name)
+
+    def __flush__(self, name):
+        """Передает запланированную операцию в поток записи.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        self.__timeouts__.pop(name, None)
+        operation = self.__pending__.pop(name, None)
+
+        if operation:
+            future = self.__executor__.submit(self.__apply__, name, *operation)
+            IOLoop.current().add_future(future, lambda f: self.__done__(name, operation, f))
+
+    def __done__(self, name, operation, future):
+        """Обрабатывает завершение операции.
+
+        При ошибке записи отпечаток сбрасывается, чтобы следующая запись той же конфигурации не была пропущена.
+
+        :param name: Имя вассала
+        :type name: str
+        :param operation: Выполненная операция
+        :type operation: tuple
+        :param future: Результат выполнения операции
+        :type future: Future
+        """
+        error = future.exception()
+        action, config = operation
+
+        if error:
+            log_message("Failed to {} configuration of {}: {}".format(action, name, error), "Emperor")
+
+            if action == "write" and self.__registry__.get_fingerprint(name) == VassalRegistry.fingerprint(config):
+                self.__registry__.discard(name)
+        else:
+            self.applied(name, action, config)
+
+    def applied(self, name, action, config):
+        """Обрабатывает успешно выполненную операцию над конфигурацией вассала.
+
+        Метод может быть переопределен в классе-потомке.
+
+        :param name: Имя вассала
+        :type name: str
+        :param action: Действие: write, remove или touch
+        :type action: str
+        :param config: Записанная конфигурация
+        :type config: str
+        """
+        pass
+
+    def __apply__(self, name, action, config):
+        """Выполняет операцию над конфигурационным файлом. Метод вызывается в потоке записи.
+
+        :param name: Имя вассала
+        :type name: str
+        :param action: Действие: write, remove или touch
+        :type action: str
+        :param config: Записываемая конфигурация
+        :type config: str
+        """
+        path = self.path(name)
+
+        if action == "write":
+            tmp_path = os.path.join(self.__directory__, ".{}{}.tmp".format(name, self.__extension__))
+
+            with open(tmp_path, "w") as cfg:
+                cfg.write(config)
+
+            os.rename(tmp_path, path)
+        elif action == "remove":
+            if os.path.exists(path):
+                os.remove(path)
+        elif action == "touch":
+            if os.path.exists(path):
+                os.utime(path, None)
+
+
+class ZMQVassalConfigWriter(VassalConfigWriter):
+
+    """Передает конфигурации вассалов uwsgi-emperor через монитор zmq://.
+
+    Конфигурации по-прежнему записываются в локальный манифест, который не отслеживается uwsgi-emperor
+    и используется для восстановления вассалов после перезапуска uwsgi-emperor. Каждая успешно
+    выполненная операция над манифестом отправляется uwsgi-emperor сообщением touch или destroy.
+    """
+
+    def __init__(self, directory, address, **kwargs):
+        """Инициализирует объект и подключается к монитору uwsgi-emperor.
+
+        :param directory: Директория манифеста
+        :type directory: str
+        :param address: Адрес zmq-монитора uwsgi-emperor
+        :type address: str
+        """
+        super(ZMQVassalConfigWriter, self).__init__(directory, **kwargs)
+
+        socket = zmq.Context.instance().socket(zmq.PUSH)
+        socket.connect(address)
+        self.__stream__ = ZMQStream(socket)
+
+    def applied(self, name, action, config):
+        """Отправляет выполненную операцию uwsgi-emperor.
+
+        :param name: Имя вассала
+        :type name: str
+        :param action: Действие: write, remove или touch
+        :type action: str
+        :param config: Записанная конфигурация
+        :type config: str
+        """
+        filename = os.path.basename(self.path(name)).encode("utf-8")
+
+        if action == "remove":
+            self.__stream__.send_multipart([b"destroy", filename])
+        else:
+            if action == "touch":
+                config = self.registry.get(name)
+                if config is None:
+                    return
+
+            if not isinstance(config, bytes):
+                config = config.encode("utf-8")
+
+            self.__stream__.send_multipart([b"touch", filename, config])
+
+    def replay(self):
+        """Передает uwsgi-emperor все вассалы, записанные в манифесте."""
+        for name in self.registry:
+            self.applied(name, "touch", None)
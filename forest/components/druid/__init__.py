@@ -3,7 +3,7 @@
 
 from forest.components.druid.handlers import LeafHandler, LeafStatusHandler, \
     LeavesHandler, BranchHandler, BranchListHandler, LogHandler, WebsocketLogWatcher, \
-    SpeciesListHandler, SpeciesHandler, TracebackHandler
+    SpeciesListHandler, SpeciesHandler, TracebackHandler, RPCBroadcastHandler
 from forest.components.druid.object import Druid
 
 
@@ -13,6 +13,8 @@ druid_handlers = [
     (r'/api/druid/leaf/([\w\d]+)', LeafHandler),
     (r'/api/druid/leaf/([\w\d]+)/status', LeafStatusHandler),
 
+    (r'/api/druid/rpc', RPCBroadcastHandler),
+
     (r'/api/druid/species', SpeciesListHandler),
     (r'/api/druid/species/([\w\d]+)', SpeciesHandler),
 
@@ -4,7 +4,10 @@
 from __future__ import unicode_literals, print_function
 
 import random
+import time
+from collections import defaultdict
 from datetime import datetime
+from fnmatch import fnmatch
 from itertools import product
 
 from tornado import gen, web, websocket
@@ -14,11 +17,11 @@ from bson.errors import InvalidId
 
 from forest.jsonschema.decorators import schema
 
-from forest.components.common import loads, dumps
+from forest.components.common import dumps
 from forest.components.api.decorators import token_auth
 from forest.components.common import send_request
 from forest.components.druid.shortcuts import branch_prepare_species, branch_start_leaf, air_enable_host, \
-    branch_stop_leaf, full_leaf_info
+    branch_stop_leaf, full_leaf_info, branch_broadcast_rpc
 
 
 # pylint: disable=W0221,W0612,W0613
@@ -104,7 +107,10 @@ class LeavesHandler(web.RequestHandler):
                     "active": data.get("start", True),
                     "address": [data["address"]],
                     "branch": branch["name"],
-                    "settings": data.get("settings", {})
+                    "settings": data.get("settings", {}),
+                    "scaling": data.get("scaling"),
+                    "idle": data.get("idle"),
+                    "cache": data.get("cache")
                 }
             )
 
@@ -162,17 +168,17 @@ class LeafHandler(web.RequestHandler):
 
     @gen.coroutine
     @token_auth
-    def patch(self, leaf_name):
+    @schema("druid.leaf")
+    def patch(self, leaf_name, **data):
         """Модифицирует информацию о листе.
 
         :param leaf_name: Имя листа
         :type leaf_name: str
         """
-        # Обрабатываем только ключи active, address
+        # Обрабатываем только ключи active, address, scaling, preload, postfork, idle, cache
         apply_changes = self.get_argument("apply", default="TRUE").upper() == "TRUE"
 
-        keys = ["active", "address"]
-        data = loads(self.request.body)
+        keys = ["active", "address", "scaling", "preload", "postfork", "idle", "cache"]
 
         for key in data.keys():
             if key not in keys:
@@ -238,6 +244,101 @@ class LeafStatusHandler(web.RequestHandler):
         self.finish(dumps(leaf_status))
 
 
+class RPCBroadcastHandler(web.RequestHandler):
+
+    """Хендлер вызова uwsgi-rpc на множестве листьев."""
+
+    @gen.coroutine
+    @token_auth
+    @schema("rpc")
+    def post(self, args, leaves=None, species=None, address=None, parallelism=10, timeout=None, **kwargs):
+        """Вызывает rpc-функцию на активных листьях, выбранных по списку имен, виду или шаблону адреса.
+
+        Вызовы группируются по ветвям и выполняются на всех ветвях одновременно.
+        """
+        started = time.time()
+        query = {"active": True}
+
+        if leaves:
+            query["name"] = {"$in": leaves}
+
+        if species:
+            try:
+                species_query = {"_id": ObjectId(species)}
+            except (TypeError, InvalidId):
+                species_query = {"name": species}
+
+            species_data = yield self.application.async_db.species.find_one(species_query)
+
+            if not species_data:
+                self.set_status(400)
+                self.finish(dumps({
+                    "result": "error",
+                    "message": "Unknown species"
+                }))
+                raise gen.Return()
+
+            query["type"] = species_data["_id"]
+
+        cursor = self.application.async_db.leaves.find(
+            query,
+            {"name": True, "branch": True, "address": True}
+        )
+
+        names = {}
+        by_branch = defaultdict(list)
+        while (yield cursor.fetch_next):
+            leaf = cursor.next_object()
+
+            if address and not any(fnmatch(a, address) for a in leaf.get("address", [])):
+                continue
+
+            names[str(leaf["_id"])] = leaf["name"]
+            by_branch[leaf["branch"]].append(str(leaf["_id"]))
+
+        request = {"args": args, "parallelism": parallelism}
+        if timeout is not None:
+            request["timeout"] = timeout
+
+        @gen.coroutine
+        def call(branch):
+            """Выполняет вызов на одной ветви, не прерывая остальные при ее недоступности."""
+            try:
+                response = yield branch_broadcast_rpc(branch, dict(request, leaves=by_branch[branch["name"]]))
+            except IOError as e:
+                response = ({"message": str(e)}, None)
+
+            raise gen.Return(response)
+
+        known = dict((x["name"], x) for x in self.application.druid.branch)
+        branches = [known[name] for name in by_branch if name in known]
+        responses = yield [call(branch) for branch in branches]
+        responses = dict((branch["name"], response) for branch, response in zip(branches, responses))
+
+        results = {}
+        for branch_name, leaf_ids in by_branch.items():
+            response, code = responses.get(branch_name, (None, None))
+
+            for leaf_id in leaf_ids:
+                if branch_name not in known:
+                    result = {"result": "failure", "message": "Unknown branch"}
+                elif code == 200:
+                    result = response["leaves"].get(leaf_id, {"result": "failure", "message": "Unknown leaf"})
+                elif code is None:
+                    result = {"result": "failure", "message": "Branch unreachable: {}".format(response["message"])}
+                else:
+                    result = {"result": "failure", "message": "Branch failure", "code": code}
+
+                result["branch"] = branch_name
+                results[names[leaf_id]] = result
+
+        self.finish(dumps({
+            "result": "success",
+            "leaves": results,
+            "time": time.time() - started
+        }))
+
+
 class SpeciesListHandler(web.RequestHandler):
 
     """Хендлер списка видов."""
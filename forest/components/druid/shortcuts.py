@@ -59,6 +59,19 @@ def branch_stop_leaf(branch, leaf):
     raise Return(response)
 
 
+@coroutine
+def branch_broadcast_rpc(branch, request):
+    """Вызывает rpc-функцию на нескольких листьях указанной ветви.
+
+    :param branch: Ветвь
+    :type branch: dict
+    :param request: Описание вызова: аргументы, листья и ограничения
+    :type request: dict
+    """
+    response = yield send_request(branch, "branch/rpc", "POST", request)
+    raise Return(response)
+
+
 @coroutine
 def air_enable_host(air, host):
     """Разрешает указанный хост на прокси-сервере.
@@ -85,5 +98,9 @@ def full_leaf_info(leaf, air_servers, species):
     leaf["fastrouters"] = ["{host}:{fastrouter}".format(**a) for a in air_servers]
     leaf["uwsgi_mules"] = species.get("uwsgi_mules", [])
     leaf["uwsgi_triggers"] = species.get("triggers", {})
+    leaf["postfork"] = leaf.get("postfork") or species.get("postfork", [])
+
+    if leaf.get("preload") is None:
+        leaf["preload"] = species.get("preload")
 
     return leaf
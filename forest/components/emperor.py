@@ -1,26 +1,34 @@
 # -*- coding: utf-8 -*-
 """Модуль описывает классы-обертки для сервера uwsgi-emperor и управляемых им вассалов.
 
-В качестве монитора вассалов используется стандартный glob://, а конфигурационные файлы хранятся в формате ini.
+В качестве монитора вассалов по умолчанию используется стандартный glob://, а конфигурационные файлы хранятся
+в формате ini. Опционально конфигурации могут передаваться uwsgi-emperor через монитор zmq://.
 """
 
 from __future__ import print_function, unicode_literals
 
 import os
-import socket
+import time
 import psutil
+import socket
 import subprocess
-from struct import pack, unpack
 
 import simplejson as json
 import zmq
+from concurrent.futures import ThreadPoolExecutor
 from zmq.eventloop.zmqstream import ZMQStream
 
-from forest.components.common import log_message
+from forest.components.common import log_message, connect
+from forest.components.configwriter import VassalConfigWriter, ZMQVassalConfigWriter
+from forest.components.lifecycle import Lifecycle, STOPPED, SCHEDULED, STARTED, RUNNING, FAILED
 from forest.components.logparse import logparse_emperor
+from forest.components.registry import VassalRegistry
+from forest.components.rpc import RPCClient
+from forest.components.scheduler import StartScheduler
 from tornado.tcpclient import TCPClient
-from tornado.gen import coroutine, Return
-from tornado.iostream import StreamClosedError
+from tornado.gen import coroutine, Return, sleep, with_timeout, TimeoutError
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
 
 
 # pylint: disable=W0612,W0613
@@ -53,7 +61,7 @@ class Vassal(object):
         """
         self.__id__ = _id
         self.__emperor__ = emperor
-        self.__status__ = "Stopped"
+        self.lifecycle = Lifecycle()
 
         self.__uwsgi_cron__ = uwsgi_cron or []
         self.__uwsgi_mules__ = uwsgi_mules or []
@@ -75,18 +83,53 @@ class Vassal(object):
         :returns: Статус вассала
         :rtype: str
         """
-        return self.__status__
+        return self.lifecycle.state
 
     @status.setter
     def status(self, value):
-        """Устанавливает статус вассала и логгирует его.
+        """Переводит вассала в новый статус и логгирует переход.
+
+        Недопустимые переходы логгируются и игнорируются.
 
         :param value: Новый статус
         :type value: str
         """
-        if value != self.__status__:
+        try:
+            record = self.lifecycle.transition(value)
+        except Lifecycle.InvalidTransition as e:
+            log_message("{} ignored invalid transition {}".format(self.id, e), self.__class__.__name__)
+            return
+
+        if record:
             log_message("{} entered '{}' state".format(self.id, value), self.__class__.__name__)
-            self.__status__ = value
+            self.on_transition(record)
+
+    def on_transition(self, record):
+        """Обрабатывает переход вассала в новое состояние.
+
+        Метод может быть переопределен в классе-потомке.
+
+        :param record: Запись о переходе
+        :type record: dict
+        """
+        pass
+
+    def inherit(self, previous):
+        """Переносит накопленное состояние с предыдущего экземпляра того же вассала.
+
+        :param previous: Предыдущий экземпляр вассала
+        :type previous: Vassal
+        """
+        self.lifecycle = previous.lifecycle
+
+    @property
+    def priority(self):
+        """Приоритет вассала в очереди запуска.
+
+        :returns: Приоритет; вассалы с большим приоритетом запускаются раньше
+        :rtype: float
+        """
+        return 0
 
     @property
     def dict(self):
@@ -104,13 +147,12 @@ class Vassal(object):
         }
 
     def start(self):
-        """Запускает вассала и устанавливает соответствующий статус."""
-        self.status = "Started"
+        """Запускает вассала. Статус вассала устанавливается uwsgi-emperor в зависимости от очереди запуска."""
         self.__emperor__.start_vassal(self)
 
     def stop(self):
         """Останавливает вассала и устанавливает соответствующий статус."""
-        self.status = "Stopped"
+        self.status = STOPPED
         self.__emperor__.stop_vassal(self)
 
     def get_config(self):
@@ -159,17 +201,78 @@ class Emperor(object):
 
     """Обертка вокруг uwsgi-emperor, отвечающая за его запуск и управление вассалами."""
 
-    def __init__(self, root_dir):
+    def __init__(
+            self,
+            root_dir,
+            stats_interval=1.0,
+            stats_timeout=5,
+            rpc_timeout=5,
+            write_delay=0.05,
+            start_concurrency=10,
+            start_rate=10.0,
+            start_timeout=60,
+            monitor="glob",
+            monitor_address="tcp://127.0.0.1:5250"
+    ):
         """Инициализирует uwsgi-emperor.
 
         :param root_dir: Полный путь к корневой директории uwsgi-emperor
         :type root_dir: str
+        :param stats_interval: Интервал обновления снимка статистики uwsgi-emperor в секундах
+        :type stats_interval: float
+        :param stats_timeout: Таймаут чтения статистики uwsgi-emperor в секундах
+        :type stats_timeout: float
+        :param rpc_timeout: Таймаут вызова rpc-функций вассалов по умолчанию в секундах
+        :type rpc_timeout: float
+        :param write_delay: Окно объединения изменений конфигурации одного вассала в секундах
+        :type write_delay: float
+        :param start_concurrency: Максимальное количество одновременно запускающихся вассалов
+        :type start_concurrency: int
+        :param start_rate: Максимальное количество запусков вассалов в секунду
+        :type start_rate: float
+        :param start_timeout: Время в секундах, после которого запуск вассала перестает учитываться в очереди
+        :type start_timeout: float
+        :param monitor: Монитор вассалов uwsgi-emperor: glob или zmq
+        :type monitor: str
+        :param monitor_address: Адрес zmq-монитора uwsgi-emperor
+        :type monitor_address: str
         """
         self.__root_dir__ = root_dir
-
-        if not os.path.exists(self.vassal_dir):
+        self.__stats_interval__ = stats_interval
+        self.__stats_timeout__ = stats_timeout
+        self.__stats_index__ = {}
+        self.__stats_updated__ = None
+        self.__stats_future__ = None
+        self.__stats_failed__ = False
+        self.__tcp_client__ = TCPClient()
+        self.__rpc_clients__ = {}
+        self.__rpc_timeout__ = rpc_timeout
+        self.__executor__ = ThreadPoolExecutor(1)
+
+        self.__monitor__ = monitor
+        self.__monitor_address__ = monitor_address
+
+        if not os.path.exists(self.config_dir):
             log_message("Vassal directory does not exist, creating one", component="Emperor")
-            os.mkdir(self.vassal_dir)
+            os.mkdir(self.config_dir)
+
+        if not os.path.exists(self.stats_dir):
+            os.mkdir(self.stats_dir)
+
+        self.__registry__ = VassalRegistry(self.config_dir, on_change=self.__config_changed__)
+
+        if self.__monitor__ == "zmq":
+            self.__writer__ = ZMQVassalConfigWriter(
+                self.config_dir, self.__monitor_address__, delay=write_delay, registry=self.__registry__
+            )
+        else:
+            self.__writer__ = VassalConfigWriter(self.config_dir, delay=write_delay, registry=self.__registry__)
+
+        self.__scheduler__ = StartScheduler(
+            concurrency=start_concurrency,
+            rate=start_rate,
+            start_timeout=start_timeout
+        )
 
         emperor_pid = 0
 
@@ -188,7 +291,7 @@ class Emperor(object):
                 [
                     self.uwsgi_binary,
                     "--plugins-dir", self.binary_dir,
-                    "--emperor", self.vassal_dir,
+                    "--emperor", self.emperor_monitor,
                     "--pidfile", self.pidfile,
                     "--logger", "zeromq:tcp://127.0.0.1:5123",
                     "--daemonize", "/dev/null",
@@ -205,6 +308,10 @@ class Emperor(object):
             assert code == 0, "Error starting emperor server"
             log_message("Started emperor server", component="Emperor")
 
+            if self.__monitor__ == "zmq":
+                log_message("Restoring vassals from manifest", component="Emperor")
+                self.__writer__.replay()
+
         self.vassals = {}
 
         ctx = zmq.Context()
@@ -213,6 +320,8 @@ class Emperor(object):
         self.stream = ZMQStream(s)
         self.stream.on_recv(self.log_message)
 
+        IOLoop.current().spawn_callback(self.__poll_stats__)
+
     @property
     def root_dir(self):
         """Корневая директория uwsgi-emperor.
@@ -249,6 +358,81 @@ class Emperor(object):
         """
         return os.path.join(self.root_dir, "vassals")
 
+    @property
+    def stats_dir(self):
+        """Директория сокетов серверов статистики вассалов.
+
+        :returns: Полный путь к директории сокетов
+        :rtype: str
+        """
+        return os.path.join(self.root_dir, "stats")
+
+    def vassal_stats_socket(self, name):
+        """Возвращает путь к сокету сервера статистики вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Полный путь к сокету
+        :rtype: str
+        """
+        return os.path.join(self.stats_dir, "{}.sock".format(name))
+
+    @coroutine
+    def vassal_stats(self, name):
+        """Считывает статистику с собственного сервера статистики вассала.
+
+        В отличие от статистики uwsgi-emperor содержит сведения о воркерах, кэшах и маршрутах вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Статистика вассала или None, если сервер статистики недоступен
+        :rtype: dict
+        """
+        stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+
+        try:
+            yield stream.connect(self.vassal_stats_socket(name))
+            data = yield stream.read_until_close()
+        except (StreamClosedError, IOError):
+            raise Return(None)
+        finally:
+            stream.close()
+
+        try:
+            raise Return(json.loads(data))
+        except ValueError:
+            raise Return(None)
+
+    @property
+    def manifest_dir(self):
+        """Директория манифеста вассалов, передаваемых через zmq-монитор.
+
+        :returns: Полный путь к директории манифеста
+        :rtype: str
+        """
+        return os.path.join(self.root_dir, "manifest")
+
+    @property
+    def config_dir(self):
+        """Директория, в которой хранятся конфигурации вассалов при текущем мониторе.
+
+        :returns: Полный путь к директории конфигураций
+        :rtype: str
+        """
+        return self.manifest_dir if self.__monitor__ == "zmq" else self.vassal_dir
+
+    @property
+    def emperor_monitor(self):
+        """Монитор вассалов, передаваемый uwsgi-emperor при запуске.
+
+        :returns: Директория вассалов или адрес zmq-монитора
+        :rtype: str
+        """
+        if self.__monitor__ == "zmq":
+            return "zmq://{}".format(self.__monitor_address__)
+
+        return self.vassal_dir
+
     @property
     def pidfile(self):
         """Pid-файл uwsgi-emperor.
@@ -265,81 +449,211 @@ class Emperor(object):
         :returns: Список имен активных вассалов
         :rtype: list
         """
-        raw_names = os.listdir(self.vassal_dir)
-        return [name[:-4] for name in raw_names]
+        return self.__registry__.names
+
+    def vassal_config(self, name):
+        """Возвращает текущую конфигурацию вассала из реестра.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Конфигурация вассала или None, если вассал неизвестен
+        :rtype: str
+        """
+        return self.__registry__.get(name)
+
+    def vassal_fingerprint(self, name):
+        """Возвращает отпечаток текущей конфигурации вассала из реестра.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Отпечаток конфигурации или None, если вассал неизвестен
+        :rtype: str
+        """
+        return self.__registry__.get_fingerprint(name)
+
+    def __config_changed__(self, name, config):
+        """Обрабатывает внешнее изменение конфигурации вассала.
+
+        Реестр к этому моменту уже содержит новую конфигурацию, поэтому следующий запуск управляемого
+        вассала перезапишет ее.
+
+        :param name: Имя вассала
+        :type name: str
+        :param config: Новая конфигурация или None, если файл удален
+        :type config: str
+        """
+        vassal = self.vassals.get(name)
+
+        if vassal and config is None:
+            log_message("Config of managed vassal {} was removed externally".format(name), component="Emperor")
+        elif vassal:
+            log_message("Config of managed vassal {} was modified externally".format(name), component="Emperor")
 
     @coroutine
-    def call_vassal_rpc(self, vassal, *args):
+    def call_vassal_rpc(self, vassal, *args, **kwargs):
         """Вызывает rpc-функцию вассала.
 
         :param vassal: Имя вассала
         :type vassal: str
+        :param timeout: Таймаут вызова в секундах
+        :type timeout: float
         :returns: Результат выполнения функции
         :rtype: dict
+        :raise ValueError: Аргументы не помещаются в пакет uwsgi-rpc
         """
-        stats = self.stats(vassal)
-        try:
-            assert "pid" in stats
+        RPCClient.pack(args)
 
-            process = psutil.Process(stats["pid"])
-            host, port = process.connections()[0].laddr
+        stats = yield self.stats(vassal)
+        client = self.__rpc_clients__.get(str(vassal))
 
-            client = yield TCPClient().connect(host, port)
-            yield client.write(pack('<BHB', 173, sum(2 + len(arg) for arg in args), 0))
+        if not client:
+            client = self.__rpc_clients__[str(vassal)] = RPCClient(self.__tcp_client__, self.__rpc_timeout__)
 
-            for arg in args:
-                yield client.write(pack('<H', len(arg)) + arg)
-
-            data = yield client.read_bytes(4)
-            modifier1, datasize, modifier2 = unpack("<BHB", data)
+        try:
+            assert "pid" in stats
 
-            data = yield client.read_bytes(datasize)
+            data = yield client.call(stats["pid"], *args, timeout=kwargs.get("timeout"))
             raise Return({
                 "result": "success",
                 "data": data
             })
 
-        except (AssertionError, psutil.NoSuchProcess):
+        except (AssertionError, RPCClient.NotRunning):
             raise Return({
                 "result": "failure",
                 "message": "Not running"
             })
-        except StreamClosedError:
+        except (StreamClosedError, IOError):
             raise Return({
                 "result": "failure",
                 "message": "Call failure"
             })
+        except TimeoutError:
+            raise Return({
+                "result": "failure",
+                "message": "Timeout"
+            })
+
+    @coroutine
+    def memory(self, vassal):
+        """Возвращает использование памяти мастер-процессом вассала и его воркерами.
+
+        Карты памяти процессов читаются вне IOLoop.
+
+        :param vassal: Имя вассала
+        :type vassal: str
+        :returns: Использование памяти или None, если вассал не запущен
+        :rtype: dict
+        """
+        stats = yield self.stats(vassal)
+
+        if "pid" not in stats:
+            raise Return(None)
+
+        usage = yield self.__executor__.submit(self.__process_memory__, stats["pid"])
+        raise Return(usage)
+
+    @staticmethod
+    def __process_memory__(pid):
+        """Считывает разделяемую и приватную память процесса и его дочерних процессов.
+
+        :param pid: pid мастер-процесса
+        :type pid: int
+        :returns: Использование памяти в байтах: по мастеру, по каждому воркеру и суммарное
+        :rtype: dict
+        """
+        def usage(process):
+            maps = process.memory_maps(grouped=True)
+            return {
+                "pid": process.pid,
+                "rss": sum(_.rss for _ in maps),
+                "pss": sum(_.pss for _ in maps),
+                "shared": sum(_.shared_clean + _.shared_dirty for _ in maps),
+                "private": sum(_.private_clean + _.private_dirty for _ in maps)
+            }
+
+        try:
+            master = psutil.Process(pid)
+            data = {
+                "master": usage(master),
+                "workers": []
+            }
+
+            for child in master.children():
+                try:
+                    data["workers"].append(usage(child))
+                except psutil.NoSuchProcess:
+                    continue
+        except psutil.NoSuchProcess:
+            return None
+
+        processes = [data["master"]] + data["workers"]
+        data["total"] = {
+            key: sum(_[key] for _ in processes) for key in ("rss", "pss", "shared", "private")
+        }
+
+        return data
 
     def stop(self):
         """Останавливает uwsgi-emperor и очищает директорию вассалов."""
         log_message("Stopping uwsgi emperor", component="Emperor")
+        self.__writer__.cancel()
+        self.__registry__.close()
         subprocess.call([self.uwsgi_binary, "--stop", self.pidfile])
         os.remove(self.pidfile)
 
-        for name in os.listdir(self.vassal_dir):
-            os.remove(os.path.join(self.vassal_dir, name))
+        for name in os.listdir(self.config_dir):
+            os.remove(os.path.join(self.config_dir, name))
 
     def start_vassal(self, vassal):
         """Запускает указанного вассала.
 
+        Вассал с неизменившейся конфигурацией не перезапускается. Иначе запуск ставится в очередь
+        планировщика, и конфигурация записывается только после допуска.
+
         :param vassal: Запускаемый вассал
         :type vassal: Vassal
         """
-        cfg_path = os.path.join(self.vassal_dir, "{}.ini".format(vassal.id))
-
         self.vassals[str(vassal.id)] = vassal
 
-        if os.path.exists(cfg_path):
-            with open(cfg_path, "r") as cfg:
-                data = cfg.read()
+        if not self.__writer__.changed(vassal.id, vassal.get_config()):
+            self.__scheduler__.cancel(vassal.id)
+            vassal.status = RUNNING if self.__stats_index__.get(vassal.id, {}).get("ready") else STARTED
+            return
+
+        vassal.status = SCHEDULED
+        self.__scheduler__.schedule(vassal, self.__admit_vassal__)
+
+    def __admit_vassal__(self, vassal):
+        """Записывает конфигурацию вассала, допущенного к запуску планировщиком.
+
+        :param vassal: Запускаемый вассал
+        :type vassal: Vassal
+        :returns: Флаг фактического запуска
+        :rtype: bool
+        """
+        if self.vassals.get(str(vassal.id)) is not vassal:
+            return False
 
-            if data == vassal.get_config():
-                return
+        existing = vassal.id in self.__writer__
+        vassal.status = STARTED
 
+        if not self.__writer__.write(vassal.id, vassal.get_config()):
+            return False
+
+        if existing:
             log_message("Leaf {} have stale configuration, will restart".format(vassal.id))
 
-        with open(cfg_path, "w") as cfg:
-            cfg.write(vassal.get_config())
+        return True
+
+    @property
+    def start_queue(self):
+        """Статистика очереди запуска вассалов.
+
+        :returns: Словарь со статистикой очереди
+        :rtype: dict
+        """
+        return self.__scheduler__.stats
 
     def stop_vassal(self, vassal):
         """Останавливает указанного вассала.
@@ -347,13 +661,13 @@ class Emperor(object):
         :param vassal: Останавливаемый вассал
         :type vassal: Vassal
         """
-        cfg_path = os.path.join(self.vassal_dir, "{}.ini".format(vassal.id))
-
         if str(vassal.id) in self.vassals:
             del self.vassals[str(vassal.id)]
 
-        if os.path.exists(cfg_path):
-            os.remove(cfg_path)
+        self.__rpc_clients__.pop(str(vassal.id), None)
+        self.__scheduler__.cancel(vassal.id)
+        self.__scheduler__.release(vassal.id)
+        self.__writer__.remove(vassal.id)
 
     def soft_restart_vassal(self, vassal):
         """Выполняет плавный перезапуск вассала.
@@ -361,43 +675,131 @@ class Emperor(object):
         :param vassal: Перезапускаемый вассал
         :type vassal: Vassal
         """
-        cfg_path = os.path.join(self.vassal_dir, "{}.ini".format(vassal.id))
+        if vassal.id in self.__writer__:
+            vassal.status = STARTED
+            self.__writer__.touch(vassal.id)
+
+    def reload_vassal(self, vassal):
+        """Перезапускает вассала с актуальной конфигурацией.
+
+        Если конфигурация вассала изменилась, она записывается заново, что приводит к плавному перезапуску
+        через uwsgi-emperor; иначе выполняется плавный перезапуск с прежней конфигурацией. В обоих случаях
+        перезапуск проходит через очередь планировщика, поэтому одновременно перезапускаемые вассалы
+        (например, все листья обновленного вида) перезапускаются с теми же ограничениями, что и запускаемые.
+
+        :param vassal: Перезапускаемый вассал
+        :type vassal: Vassal
+        """
+        if vassal.id in self.__writer__ and not self.__writer__.changed(vassal.id, vassal.get_config()):
+            self.vassals[str(vassal.id)] = vassal
+            self.__scheduler__.schedule(vassal, self.__admit_reload__)
+        else:
+            self.start_vassal(vassal)
+
+    def __admit_reload__(self, vassal):
+        """Плавно перезапускает вассала, допущенного к перезапуску планировщиком.
+
+        :param vassal: Перезапускаемый вассал
+        :type vassal: Vassal
+        :returns: Флаг фактического перезапуска
+        :rtype: bool
+        """
+        if self.vassals.get(str(vassal.id)) is not vassal or vassal.id not in self.__writer__:
+            return False
 
-        if os.path.exists(cfg_path):
-            os.utime(cfg_path, None)
+        self.soft_restart_vassal(vassal)
+        return True
 
-    def stats(self, vassal):
+    @property
+    def stats_age(self):
+        """Возраст текущего снимка статистики uwsgi-emperor.
+
+        :returns: Время с момента последнего обновления снимка в секундах
+        :rtype: float
+        """
+        if self.__stats_updated__ is None:
+            return float("inf")
+
+        return time.time() - self.__stats_updated__
+
+    @coroutine
+    def stats(self, vassal, max_staleness=None):
         """Возвращает статистику по указанному вассалу.
 
         :param vassal: Имя вассала
         :type vassal: str
+        :param max_staleness: Максимально допустимый возраст снимка статистики в секундах
+        :type max_staleness: float
         :returns: Статистика по вассалу
         :rtype: dict
         """
-        for l in self.__stats__()["vassals"]:
-            if l["id"] == "{}.ini".format(vassal):
-                return l
+        snapshot = yield self.stats_snapshot(max_staleness)
+        raise Return(snapshot.get(str(vassal), {}))
 
-        return {}
+    @coroutine
+    def stats_snapshot(self, max_staleness=None):
+        """Возвращает снимок статистики всех вассалов, индексированный по их именам.
 
-    def __stats__(self):
-        """Возвращает внутреннюю статистику uwsgi-emperor.
+        Если снимок старше max_staleness, перед возвратом выполняется его внеочередное обновление.
+        Без указания max_staleness возвращается текущий снимок вне зависимости от его возраста.
 
-        :returns: Словарь со статистикой
+        :param max_staleness: Максимально допустимый возраст снимка статистики в секундах
+        :type max_staleness: float
+        :returns: Словарь статистики вассалов
         :rtype: dict
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(("127.0.0.1", 1777))
+        if max_staleness is not None and self.stats_age > max_staleness:
+            yield self.refresh_stats()
+
+        raise Return(self.__stats_index__)
+
+    def refresh_stats(self):
+        """Запускает обновление снимка статистики.
+
+        Одновременные вызовы ожидают завершения одного и того же обновления.
+
+        :returns: Future, завершающийся после обновления снимка
+        :rtype: Future
+        """
+        if self.__stats_future__ is None or self.__stats_future__.done():
+            self.__stats_future__ = self.__refresh_stats__()
 
-        data = ""
+        return self.__stats_future__
 
+    @coroutine
+    def __poll_stats__(self):
+        """Периодически обновляет снимок статистики uwsgi-emperor."""
         while True:
-            new_data = s.recv(4096)
-            if len(new_data) < 1:
-                break
-            data += new_data.decode('utf8')
+            yield self.refresh_stats()
+            yield sleep(self.__stats_interval__)
 
-        return json.loads(data)
+    @coroutine
+    def __refresh_stats__(self):
+        """Асинхронно считывает внутреннюю статистику uwsgi-emperor и обновляет снимок.
+
+        Подключение и чтение вместе ограничены stats_timeout секундами.
+        """
+        deadline = IOLoop.current().time() + self.__stats_timeout__
+
+        try:
+            stream = yield connect(self.__tcp_client__, "127.0.0.1", 1777, deadline)
+            try:
+                data = yield with_timeout(deadline, stream.read_until_close(), quiet_exceptions=StreamClosedError)
+            finally:
+                stream.close()
+
+            stats = json.loads(data.decode("utf8"))
+        except (StreamClosedError, IOError, ValueError, TimeoutError) as e:
+            if not self.__stats_failed__:
+                log_message("Failed to read emperor stats: {}".format(e), component="Emperor")
+                self.__stats_failed__ = True
+            return
+
+        self.__stats_failed__ = False
+        self.__stats_index__ = dict(
+            (os.path.splitext(l["id"])[0], l) for l in stats.get("vassals", [])
+        )
+        self.__stats_updated__ = time.time()
 
     @coroutine
     def log_message(self, message):
@@ -411,12 +813,18 @@ class Emperor(object):
 
             if data.get("log_type") == "emperor_vassal_ready":
                 vassal_id = data.get("vassal")
+                self.__scheduler__.release(vassal_id)
                 if vassal_id in self.vassals:
-                    self.vassals[vassal_id].status = "Running"
+                    vassal = self.vassals[vassal_id]
+                    if vassal.status == RUNNING:
+                        vassal.lifecycle.respawned()
+                    vassal.status = RUNNING
             elif data.get("log_type") == "emperor_vassal_removed":
                 vassal_id = data.get("vassal")
+                self.__scheduler__.release(vassal_id)
                 if vassal_id in self.vassals:
-                    if self.vassals[vassal_id].status in ("Started", "Failed"):
-                        self.vassals[vassal_id].status = "Failed"
-                    else:
-                        self.vassals[vassal_id].status = "Stopped"
+                    vassal = self.vassals[vassal_id]
+                    if vassal.status in (STARTED, FAILED):
+                        vassal.status = FAILED
+                    elif vassal.status == RUNNING:
+                        vassal.status = STOPPED
@@ -0,0 +1,206 @@
+# coding=utf-8
+"""Модуль описывает общее для видов хранилище виртуальных окружений."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from simplejson import JSONDecodeError
+from toro import Lock
+from tornado.gen import coroutine, Return
+
+from forest.components.common import log_message, dump, load, replace_symlink
+
+
+class EnvironmentStore(object):
+
+    """Хранилище виртуальных окружений, адресуемых по содержимому.
+
+    Окружение определяется интерпретатором и содержимым requirements.txt: виды с одинаковыми
+    зависимостями используют одно окружение, а обновление вида без изменения зависимостей не пересоздает
+    его. Директория env вида является символической ссылкой на окружение в хранилище. Окружение считается
+    собранным после появления в нем маркера .ready. Хранилище учитывает, какие версии видов ссылаются
+    на каждое окружение (индекс refs.json), и удаляет окружения, на которые не ссылается ни одна версия.
+    """
+
+    INDEX = "refs.json"
+    READY = ".ready"
+
+    def __init__(self, directory):
+        """Инициализирует хранилище.
+
+        :param directory: Директория хранилища
+        :type directory: str
+        """
+        self.__directory__ = directory
+        self.__locks__ = {}
+        self.__executor__ = ThreadPoolExecutor(1)
+
+        if not os.path.exists(self.__directory__):
+            os.makedirs(self.__directory__)
+
+    @staticmethod
+    def key(interpreter, requirements):
+        """Вычисляет ключ окружения.
+
+        :param interpreter: Интерпретатор python
+        :type interpreter: str
+        :param requirements: Путь к файлу requirements.txt
+        :type requirements: str
+        :returns: Ключ окружения
+        :rtype: str
+        """
+        digest = hashlib.sha1(interpreter.encode("utf-8") + b"\n")
+
+        if os.path.exists(requirements):
+            with open(requirements, "rb") as f:
+                digest.update(f.read())
+
+        return "{}-{}".format(interpreter, digest.hexdigest())
+
+    def path(self, key):
+        """Возвращает путь к окружению.
+
+        :param key: Ключ окружения
+        :type key: str
+        :returns: Полный путь к директории окружения
+        :rtype: str
+        """
+        return os.path.join(self.__directory__, key)
+
+    def lock(self, key):
+        """Возвращает блокировку, под которой собирается и подключается окружение.
+
+        :param key: Ключ окружения
+        :type key: str
+        :rtype: Lock
+        """
+        return self.__locks__.setdefault(key, Lock())
+
+    def is_ready(self, key):
+        """Проверяет, собрано ли окружение.
+
+        :param key: Ключ окружения
+        :type key: str
+        :rtype: bool
+        """
+        return os.path.exists(os.path.join(self.path(key), self.READY))
+
+    def mark_ready(self, key):
+        """Отмечает окружение собранным.
+
+        :param key: Ключ окружения
+        :type key: str
+        """
+        open(os.path.join(self.path(key), self.READY), "w").close()
+
+    def prepare(self, key):
+        """Удаляет остатки несобранного окружения перед его сборкой.
+
+        :param key: Ключ окружения
+        :type key: str
+        """
+        if os.path.lexists(self.path(key)):
+            shutil.rmtree(self.path(key))
+
+    def link(self, key, owner, target):
+        """Атомарно направляет ссылку окружения вида на окружение из хранилища.
+
+        Если по пути ссылки находится собственное окружение вида, оно удаляется.
+
+        :param key: Ключ окружения
+        :type key: str
+        :param owner: Идентификатор владельца ссылки (версии вида)
+        :type owner: str
+        :param target: Путь к ссылке окружения вида
+        :type target: str
+        """
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+
+        replace_symlink(self.path(key), target)
+
+        refs = self.__load_refs__()
+        refs[str(owner)] = key
+        self.__save_refs__(refs)
+
+    def release(self, owner):
+        """Удаляет ссылку владельца на окружение.
+
+        :param owner: Идентификатор владельца ссылки
+        :type owner: str
+        """
+        refs = self.__load_refs__()
+        if refs.pop(str(owner), None) is not None:
+            self.__save_refs__(refs)
+
+    def references(self, key):
+        """Возвращает количество версий видов, использующих окружение.
+
+        :param key: Ключ окружения
+        :type key: str
+        :rtype: int
+        """
+        return sum(1 for _ in self.__load_refs__().values() if _ == key)
+
+    @coroutine
+    def collect(self):
+        """Удаляет окружения, на которые не ссылается ни одна версия вида и которые не собираются в данный момент.
+
+        Окружения удаляются вне IOLoop под их блокировками, поэтому сборка не может подключить окружение
+        во время его удаления.
+
+        :returns: Список ключей удаленных окружений
+        :rtype: list
+        """
+        used = set(self.__load_refs__().values())
+        removed = []
+
+        for key in os.listdir(self.__directory__):
+            if key.startswith(".") or key == self.INDEX or key in used:
+                continue
+
+            lock = self.lock(key)
+            if lock.locked():
+                continue
+
+            with (yield lock.acquire()):
+                # Пока удалялись предыдущие окружения, окружение могла подключить новая версия вида
+                if key in self.__load_refs__().values():
+                    continue
+
+                yield self.__executor__.submit(shutil.rmtree, self.path(key), True)
+                removed.append(key)
+
+        if removed:
+            log_message("Removed {} unused environments".format(len(removed)), "Species")
+
+        raise Return(removed)
+
+    def __load_refs__(self):
+        """Загружает индекс ссылок версий видов на окружения.
+
+        :returns: Словарь ключей окружений по владельцам ссылок
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self.__directory__, self.INDEX), "r") as f:
+                return load(f)
+        except (IOError, JSONDecodeError):
+            return {}
+
+    def __save_refs__(self, refs):
+        """Атомарно сохраняет индекс ссылок версий видов на окружения.
+
+        :param refs: Словарь ключей окружений по владельцам ссылок
+        :type refs: dict
+        """
+        tmp_path = os.path.join(self.__directory__, ".{}.tmp".format(self.INDEX))
+
+        with open(tmp_path, "w") as f:
+            dump(refs, f)
+
+        os.rename(tmp_path, os.path.join(self.__directory__, self.INDEX))
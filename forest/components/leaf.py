@@ -1,10 +1,25 @@
 # coding=utf-8
 """Описывает класс Leaf, управляющий приложением как uwsgi-вассалом."""
 
+import time
 from itertools import product
+from os.path import join, realpath, dirname
 
 from forest.components.emperor import Vassal
+from forest.components.lifecycle import QUEUED, PAUSED, STARTED, RUNNING
 from forest.components.common import dumps
+from forest.components.metrics import DecayingCounter
+from forest.components.species import normalize_cache
+
+
+SCALING_ALGORITHMS = ("spare", "backlog", "busyness")
+
+# Сообщения мастер-процесса uwsgi о переходе в экономный режим и о создании воркеров
+CHEAP_MODE_MESSAGE = "cheap mode enabled: waiting for socket connection"
+WORKER_SPAWN_MESSAGE = "spawned uWSGI worker"
+
+# Директория модулей, импортируемых uwsgi внутри листа
+LEAF_MODULES = join(dirname(dirname(realpath(__file__))), "uwsgi")
 
 
 class Leaf(Vassal):
@@ -15,10 +30,17 @@ class Leaf(Vassal):
             self,
             address=None,
             batteries=None,
+            cache=None,
             fastrouters=None,
+            idle=None,
             keyfile=None,
             leaf_host=None,
             log_port=None,
+            media_proxy=None,
+            on_cold_start=None,
+            postfork=None,
+            preload=None,
+            scaling=None,
             settings=None,
             species=None,
             threads=False,
@@ -31,14 +53,31 @@ class Leaf(Vassal):
         :type address: list
         :param batteries: Словарь с описанием 'батареек' листа
         :type batteries: dict
+        :param cache: Правила кэширования ответов листа; если не указаны, используются правила вида
+        :type cache: dict
         :param fastrouters: Список fastrouter'ов, к которым подключается лист
         :type fastrouters: list
+        :param idle: Время простоя в секундах, после которого воркеры листа останавливаются до следующего
+                     запроса; по умолчанию воркеры работают постоянно
+        :type idle: int
         :param keyfile: Полный путь к файлу приватного ключа
         :type keyfile: str
         :param leaf_host: Хост, на котором запускается лист
         :type leaf_host: str
         :param log_port: Порт, на который отправляются логи листа
         :type log_port: int
+        :param media_proxy: Адрес кэша медиа-файлов ветви; если не указан, медиа-файлы отдаются напрямую из GridFS
+        :type media_proxy: str
+        :param on_cold_start: Функция, получающая лист и длительность каждого его запуска, в том числе
+                              выхода из экономного режима
+        :type on_cold_start: function
+        :param postfork: Список функций python вида module.function, вызываемых в каждом воркере после fork
+        :type postfork: list
+        :param preload: Загружать ли приложение в мастер-процессе до fork воркеров (True), в каждом воркере
+                        отдельно (False) или по умолчанию uwsgi (None)
+        :type preload: bool
+        :param scaling: Политика масштабирования количества воркеров (см. Leaf.scaling)
+        :type scaling: dict
         :param settings: Дополнительные настройки приложения
         :type settings: dict
         :param species: Объект вида листа
@@ -49,16 +88,29 @@ class Leaf(Vassal):
         :type workers: int
         """
         super(Leaf, self).__init__(**kwargs)
+        self.__config__ = None
         self.__keyfile__ = keyfile
         self.__fastrouters__ = fastrouters or []
         self.__species__ = species
         self.__batteries__ = batteries
+        self.__cache__ = cache
+        self.__cache_rules__ = normalize_cache(cache)
         self.__log_port__ = log_port
-        self.settings = settings or {}
-        self.address = address
-        self.workers = workers
-        self.threads = threads
-        self.leaf_host = leaf_host
+        self.__media_proxy__ = media_proxy
+        self.__on_cold_start__ = on_cold_start
+        self.__preload__ = preload
+        self.__idle__ = idle
+        self.__dormant__ = False
+        self.__woken__ = None
+        self.__postfork__ = postfork or []
+        self.__settings__ = settings or {}
+        self.__address__ = address
+        self.__workers__ = workers
+        self.__scaling__ = None
+        self.scaling = scaling
+        self.__threads__ = threads
+        self.__leaf_host__ = leaf_host
+        self.traffic = DecayingCounter()
 
         # TODO: передавать параметрами
         self.__gridfs_media__ = True
@@ -73,9 +125,232 @@ class Leaf(Vassal):
         if self.__species__.is_ready:
             super(Leaf, self).start()
             return True
-        self.status = "Queued"
+        self.status = QUEUED
         return False
 
+    def inherit(self, previous):
+        """Переносит накопленное состояние и трафик с предыдущего экземпляра листа.
+
+        :param previous: Предыдущий экземпляр листа
+        :type previous: Leaf
+        """
+        super(Leaf, self).inherit(previous)
+        self.traffic = previous.traffic
+        self.__dormant__ = previous.dormant
+        self.__woken__ = previous.__woken__
+
+    @property
+    def dormant(self):
+        """Флаг экономного режима: воркеры листа остановлены до поступления запроса.
+
+        :returns: Значение флага
+        :rtype: bool
+        """
+        return self.__dormant__
+
+    def log_output(self, line):
+        """Отслеживает переходы листа в экономный режим и выход из него по выводу мастер-процесса.
+
+        :param line: Строка вывода листа
+        :type line: str
+        """
+        if not self.__idle__:
+            return
+
+        if CHEAP_MODE_MESSAGE in line:
+            self.__dormant__ = True
+            self.__woken__ = None
+        elif self.__dormant__ and WORKER_SPAWN_MESSAGE in line:
+            self.__dormant__ = False
+            self.__woken__ = time.time()
+
+    def log_request(self):
+        """Учитывает обработанный листом запрос.
+
+        Первый запрос после выхода из экономного режима завершает холодный старт листа, длительность
+        которого (от создания воркеров до записи ответа) передается в on_cold_start.
+        """
+        self.traffic.hit()
+
+        if self.__woken__ is not None:
+            duration = time.time() - self.__woken__
+            self.__woken__ = None
+
+            if self.__on_cold_start__:
+                self.__on_cold_start__(self, duration)
+
+    def on_transition(self, record):
+        """Передает длительность запуска листа при переходе из Started в Running.
+
+        :param record: Запись о переходе
+        :type record: dict
+        """
+        if self.__on_cold_start__ and record["from"] == STARTED and record["to"] == RUNNING:
+            self.__on_cold_start__(self, record["duration"])
+
+    @property
+    def priority(self):
+        """Приоритет листа в очереди запуска, равный его недавнему трафику.
+
+        :returns: Приоритет листа
+        :rtype: float
+        """
+        return self.traffic.value
+
+    def invalidate_config(self):
+        """Сбрасывает закэшированную конфигурацию листа.
+
+        Метод должен вызываться при любом изменении данных, из которых строится конфигурация.
+        """
+        self.__config__ = None
+
+    @property
+    def settings(self):
+        """Дополнительные настройки приложения.
+
+        :returns: Словарь настроек
+        :rtype: dict
+        """
+        return self.__settings__
+
+    @settings.setter
+    def settings(self, value):
+        """Устанавливает дополнительные настройки приложения.
+
+        :param value: Словарь настроек
+        :type value: dict
+        """
+        self.__settings__ = value
+        self.invalidate_config()
+
+    @property
+    def address(self):
+        """Список адресов листа.
+
+        :returns: Список адресов
+        :rtype: list
+        """
+        return self.__address__
+
+    @address.setter
+    def address(self, value):
+        """Устанавливает список адресов листа.
+
+        :param value: Список адресов
+        :type value: list
+        """
+        self.__address__ = value
+        self.invalidate_config()
+
+    @property
+    def workers(self):
+        """Количество воркеров приложения.
+
+        :returns: Количество воркеров
+        :rtype: int
+        """
+        return self.__workers__
+
+    @workers.setter
+    def workers(self, value):
+        """Устанавливает количество воркеров приложения.
+
+        :param value: Количество воркеров
+        :type value: int
+        """
+        self.__workers__ = value
+        self.invalidate_config()
+
+    @property
+    def scaling(self):
+        """Политика масштабирования количества воркеров, реализуемая подсистемой cheaper uwsgi.
+
+        Политика содержит алгоритм (spare, backlog или busyness), минимальное и максимальное количество
+        воркеров, количество воркеров, добавляемых за один шаг, и время простоя в секундах, после
+        которого лишние воркеры останавливаются. Для алгоритма backlog вместо времени простоя используется
+        длина очереди запросов, при превышении которой добавляются воркеры.
+
+        :returns: Политика масштабирования или None, если количество воркеров фиксировано
+        :rtype: dict
+        """
+        return self.__scaling__
+
+    @scaling.setter
+    def scaling(self, value):
+        """Устанавливает политику масштабирования, дополняя ее значениями по умолчанию.
+
+        :param value: Политика масштабирования или None
+        :type value: dict
+        :raise ValueError: Политика некорректна
+        """
+        if value is not None:
+            policy = {
+                "algorithm": "spare",
+                "min_workers": 1,
+                "max_workers": self.workers,
+                "step": 1,
+                "idle": 60,
+                "backlog": 16
+            }
+            unknown = set(value) - set(policy)
+            if unknown:
+                raise ValueError("Unknown scaling options: {}".format(", ".join(sorted(unknown))))
+
+            policy.update(value)
+
+            if policy["algorithm"] not in SCALING_ALGORITHMS:
+                raise ValueError("Unknown scaling algorithm: {}".format(policy["algorithm"]))
+
+            for key in ("min_workers", "max_workers", "step", "idle", "backlog"):
+                if isinstance(policy[key], bool) or not isinstance(policy[key], int) or policy[key] < 1:
+                    raise ValueError("Scaling {} must be a positive integer".format(key))
+
+            if policy["min_workers"] >= policy["max_workers"]:
+                raise ValueError("Scaling min_workers must be less than max_workers")
+
+            value = policy
+
+        self.__scaling__ = value
+        self.invalidate_config()
+
+    @property
+    def threads(self):
+        """Флаг возможности использования потоков в приложении.
+
+        :returns: Значение флага
+        :rtype: bool
+        """
+        return self.__threads__
+
+    @threads.setter
+    def threads(self, value):
+        """Устанавливает флаг возможности использования потоков в приложении.
+
+        :param value: Значение флага
+        :type value: bool
+        """
+        self.__threads__ = value
+        self.invalidate_config()
+
+    @property
+    def leaf_host(self):
+        """Хост, на котором запускается лист.
+
+        :returns: Хост листа
+        :rtype: str
+        """
+        return self.__leaf_host__
+
+    @leaf_host.setter
+    def leaf_host(self, value):
+        """Устанавливает хост, на котором запускается лист.
+
+        :param value: Хост листа
+        :type value: str
+        """
+        self.__leaf_host__ = value
+        self.invalidate_config()
+
     @property
     def keyfile(self):
         """Используемый при аутентификации с fastrouter'ом файл ключа.
@@ -85,6 +360,39 @@ class Leaf(Vassal):
         """
         return self.__keyfile__
 
+    @property
+    def batteries(self):
+        """Словарь с описанием 'батареек' листа.
+
+        :returns: Настройки подключения к базам данных листа
+        :rtype: dict
+        """
+        return self.__batteries__
+
+    @property
+    def cache(self):
+        """Действующие правила кэширования ответов листа.
+
+        :returns: Правила листа, а при их отсутствии - правила вида; None, если кэширование не используется
+        :rtype: dict
+        """
+        if self.__cache__ is not None:
+            return self.__cache_rules__
+
+        return self.__species__.cache
+
+    @property
+    def stats_socket(self):
+        """Сокет сервера статистики листа, включаемого при кэшировании ответов.
+
+        :returns: Полный путь к сокету или None
+        :rtype: str
+        """
+        if not self.cache or not self.__emperor__:
+            return None
+
+        return self.__emperor__.vassal_stats_socket(self.id)
+
     @property
     def log_port(self):
         """Локальный порт, на который будут отправляться все логи событий.
@@ -107,7 +415,12 @@ class Leaf(Vassal):
             "fastrouters": self.__fastrouters__,
             "address": self.address,
             "batteries": self.__batteries__,
+            "cache": self.__cache__,
             "workers": self.workers,
+            "scaling": self.scaling,
+            "idle": self.__idle__,
+            "preload": self.__preload__,
+            "postfork": self.__postfork__,
             "threads": self.threads,
             "type": self.__species__.id
         })
@@ -130,6 +443,7 @@ class Leaf(Vassal):
         :type value: Species
         """
         self.__species__ = value
+        self.invalidate_config()
 
     def pause(self):
         """Приостанавливает работу листа.
@@ -137,7 +451,7 @@ class Leaf(Vassal):
         Приостановление работы отличается от полной остановки тем, что в отличии от остановки не удаляет
         конфигурационный файл полностью, а заменяет его на используемый для отображения заглушки
         """
-        self.status = "Paused"
+        self.status = PAUSED
         # TODO: Раскомментировать, когда будет работать приостановленный конфиг
         # self.__emperor__.start_vassal(self)
         self.__emperor__.stop_vassal(self)
@@ -147,11 +461,14 @@ class Leaf(Vassal):
 
         Метод get_config листа отличается от оригинального тем, что возвращает разную конфигурацию в зависимости от
         текущего статуса: обычную, в случае, если лист запущен и заглушку, если лист остановлен.
+        Обычная конфигурация кэшируется до изменения данных, из которых она строится.
         :returns: Конфигурация uwsgi-вассала
         :rtype: str
         """
-        if self.status != "Paused":
-            return self.__get_config__()
+        if self.status != PAUSED:
+            if self.__config__ is None:
+                self.__config__ = self.__get_config__()
+            return self.__config__
         else:
             return self.__get_config_paused__()
 
@@ -208,10 +525,13 @@ log-encoder=prefix [Leaf {id}]
 
 {media}
 {static}
+{cache}
 
 plugin={python}
 module=wsgi:application
-processes={workers}
+{preload}
+{processes}
+{idle}
 offload-threads=4
 {threads}
 
@@ -231,21 +551,24 @@ endif=
 """.format(
             app_settings=dumps(self.settings),
             batteries=dumps(self.__batteries__),
+            cache=self.get_cache_config(),
             chdir=self.__species__.src_path,
             cron=self.get_cron_config(),
             id=self.id,
+            idle="cheap=true\nidle={}".format(self.__idle__) if self.__idle__ else "",
             leaf_data_dict=dumps(self.dict),
             leaf_host=self.leaf_host,
             log_port=self.log_port,
             logformat=dumps(logs_format),
             media=self.get_media_config(),
             mules=self.get_mules_config(),
+            preload=self.get_preload_config(),
+            processes=self.get_processes_config(),
             python=self.__species__.python,
             static=self.get_static_config(),
             threads="enable-threads=" if self.threads else "",
             triggers=self.get_triggers_config(),
-            virtualenv=self.species.environment,
-            workers=self.workers
+            virtualenv=self.species.environment
         )
 
         for router, address in product(self.__fastrouters__, self.address):
@@ -256,24 +579,143 @@ endif=
 
         return config
 
+    def get_preload_config(self):
+        """Возвращает строку конфигурации загрузки приложения.
+
+        При загрузке в мастер-процессе воркеры получают код приложения и его зависимости через
+        copy-on-write, а соединения, которые нельзя разделять между процессами, должны открываться
+        функциями postfork. При отдельной загрузке каждый воркер импортирует приложение сам.
+
+        :returns: Строка конфигурации загрузки приложения
+        :rtype: str
+        """
+        if self.__preload__ is False:
+            return "lazy-apps=true"
+
+        config = ["lazy-apps=false"] if self.__preload__ else []
+        config += ["hook-post-fork=pycall:{}".format(_) for _ in self.__postfork__]
+
+        return "\n".join(config)
+
+    def get_processes_config(self):
+        """Возвращает строку конфигурации количества воркеров.
+
+        Без политики масштабирования запускается фиксированное количество воркеров. С политикой
+        запускается min_workers воркеров, а остальные добавляются и останавливаются подсистемой cheaper.
+
+        :returns: Строка конфигурации воркеров
+        :rtype: str
+        """
+        if not self.scaling:
+            return "processes={}".format(self.workers)
+
+        config = [
+            "processes={max_workers}",
+            "cheaper={min_workers}",
+            "cheaper-initial={min_workers}",
+            "cheaper-step={step}"
+        ]
+
+        if self.scaling["algorithm"] == "busyness":
+            # Воркер останавливается после одного цикла проверки длиной idle секунд с низкой загрузкой
+            config = ["plugin=cheaper_busyness"] + config + [
+                "cheaper-algo=busyness",
+                "cheaper-overload={idle}",
+                "cheaper-busyness-multiplier=1"
+            ]
+        elif self.scaling["algorithm"] == "backlog":
+            config += ["cheaper-algo=backlog", "cheaper-overload={backlog}"]
+        else:
+            config += ["cheaper-algo=spare", "cheaper-overload={idle}"]
+
+        return "\n".join(config).format(**self.scaling)
+
+    def get_cache_config(self):
+        """Возвращает строку конфигурации кэширования ответов.
+
+        Кэшируются только GET-запросы. Запросы без Cookie проходят все правила с ключом по REQUEST_URI,
+        запросы с Cookie - только правила с vary_cookie, ключ которых дополняется значением Cookie.
+        Для очистки кэша в листе регистрируется rpc-функция forest_cache_clear.
+
+        :returns: Строка конфигурации кэша и маршрутов
+        :rtype: str
+        """
+        cache = self.cache
+        if not cache:
+            return ""
+
+        def rule_config(rule, key):
+            return [
+                "route={} cache:key={},name=responses".format(rule["path"], key),
+                "route={} cachestore:key={},name=responses,expires={}".format(rule["path"], key, rule["ttl"])
+            ]
+
+        config = [
+            "cache2=name=responses,items={items},blocksize={blocksize}".format(**cache),
+            "route-if-not=equal:${REQUEST_METHOD};GET goto:cache-end",
+            "route-if-not=empty:${HTTP_COOKIE} goto:cache-cookie"
+        ]
+
+        for rule in cache["rules"]:
+            config += rule_config(rule, "${REQUEST_URI}")
+
+        config += ["route-run=goto:cache-end", "route-label=cache-cookie"]
+
+        for rule in (_ for _ in cache["rules"] if _["vary_cookie"]):
+            config += rule_config(rule, "${REQUEST_URI}|${HTTP_COOKIE}")
+
+        config += [
+            "route-label=cache-end",
+            "pythonpath={}".format(LEAF_MODULES),
+            "import=forest_leaf"
+        ]
+
+        if self.stats_socket:
+            config.append("stats={}".format(self.stats_socket))
+
+        return "\n".join(config)
+
     def get_static_config(self):
         """Возвращает строку конфигурации файлов статики.
 
+        Статические файлы отдаются через offload-потоки. Для файлов с хэшем содержимого в имени
+        выставляется долгий срок кэширования, при наличии сжатой версии файла отдается она, а пути
+        к файлам кэшируются, чтобы не выполнять stat на каждый запрос.
+
         :returns: Строка конфигурации статики
         :rtype: str
         """
-        return "static-map=/static={}/static".format(self.__species__.src_path)
+        static = self.__species__.static
+        config = [
+            "static-map={}={}".format(static["url"], self.__species__.static_path),
+            "static-expires={} {}".format(static["hashed"], static["expires"])
+        ]
+
+        if static["gzip"]:
+            config.append("static-gzip-all=true")
+
+        if static["cache_paths"]:
+            config += [
+                "cache2=name=static_paths,items=1000",
+                "static-cache-paths={}".format(static["cache_paths"]),
+                "static-cache-paths-name=static_paths"
+            ]
+
+        return "\n".join(config)
 
     def get_media_config(self):
         """Возвращает строку конфигурации медиа-файлов.
 
         В строке будет указан route на gridfs, если приложение использует MongoDB.
-        Настройки подключения и реплика-сет берутся по-умолчанию.
+        Настройки подключения и реплика-сет берутся по-умолчанию. Если на ветви включен кэш медиа-файлов,
+        запросы передаются ему, а лист определяется кэшем по заголовку Host.
 
         :returns: Строка конфигурации медиа-файлов
         :rtype: str
         """
-        if "mongo" in self.__batteries__ and self.__gridfs_media__:
+        if "mongo" in self.__batteries__ and self.__gridfs_media__ and self.__media_proxy__:
+            return "route=^/media/.+ http:{}".format(self.__media_proxy__)
+        elif "mongo" in self.__batteries__ and self.__gridfs_media__:
             return ("plugin=gridfs\n"
                     "route=^/media/(.+) gridfs:"
                     "server={host}:{port},"
@@ -0,0 +1,151 @@
+# coding=utf-8
+"""Модуль описывает конечный автомат жизненного цикла вассала."""
+
+from __future__ import print_function, unicode_literals
+
+import time
+from collections import deque
+
+
+STOPPED = "Stopped"
+QUEUED = "Queued"
+SCHEDULED = "Scheduled"
+STARTED = "Started"
+RUNNING = "Running"
+FAILED = "Failed"
+PAUSED = "Paused"
+
+TRANSITIONS = {
+    STOPPED: {QUEUED, SCHEDULED, STARTED, RUNNING, PAUSED},
+    QUEUED: {SCHEDULED, STARTED, RUNNING, PAUSED, STOPPED},
+    SCHEDULED: {QUEUED, STARTED, RUNNING, PAUSED, STOPPED},
+    STARTED: {QUEUED, SCHEDULED, RUNNING, FAILED, PAUSED, STOPPED},
+    RUNNING: {QUEUED, SCHEDULED, STARTED, FAILED, PAUSED, STOPPED},
+    FAILED: {QUEUED, SCHEDULED, STARTED, RUNNING, PAUSED, STOPPED},
+    PAUSED: {QUEUED, SCHEDULED, STARTED, RUNNING, STOPPED}
+}
+
+
+class Lifecycle(object):
+
+    """Жизненный цикл вассала: текущее состояние, история переходов и счетчики.
+
+    История хранится в кольцевом буфере ограниченного размера. Переходы, не описанные в TRANSITIONS,
+    отклоняются.
+    """
+
+    class InvalidTransition(Exception):
+        pass
+
+    def __init__(self, state=STOPPED, history=32):
+        """Инициализирует жизненный цикл.
+
+        :param state: Начальное состояние
+        :type state: str
+        :param history: Количество хранимых переходов
+        :type history: int
+        """
+        self.__state__ = state
+        self.__since__ = time.time()
+        self.__history__ = deque(maxlen=history)
+        self.__last_start__ = None
+        self.starts = 0
+        self.failures = 0
+        self.respawns = 0
+
+    @property
+    def state(self):
+        """Текущее состояние.
+
+        :returns: Имя состояния
+        :rtype: str
+        """
+        return self.__state__
+
+    @property
+    def since(self):
+        """Время входа в текущее состояние.
+
+        :returns: Временная метка
+        :rtype: float
+        """
+        return self.__since__
+
+    @property
+    def last_start(self):
+        """Длительность последнего запуска - время от входа в Started до входа в Running.
+
+        :returns: Длительность в секундах или None, если запусков еще не было
+        :rtype: float
+        """
+        return self.__last_start__
+
+    def transition(self, state):
+        """Выполняет переход в указанное состояние.
+
+        :param state: Новое состояние
+        :type state: str
+        :returns: Запись о переходе или None, если состояние не изменилось
+        :rtype: dict
+        :raise InvalidTransition: Переход не разрешен
+        """
+        if state == self.__state__:
+            return None
+
+        if state not in TRANSITIONS.get(self.__state__, ()):
+            raise self.InvalidTransition("{} -> {}".format(self.__state__, state))
+
+        now = time.time()
+        record = {
+            "time": now,
+            "from": self.__state__,
+            "to": state,
+            "duration": now - self.__since__
+        }
+
+        if state == STARTED:
+            self.starts += 1
+        elif state == FAILED:
+            self.failures += 1
+        elif state == RUNNING:
+            if self.__state__ == STARTED:
+                self.__last_start__ = record["duration"]
+            elif self.__state__ == FAILED:
+                self.respawns += 1
+
+        self.__history__.append(record)
+        self.__state__ = state
+        self.__since__ = now
+
+        return record
+
+    def respawned(self):
+        """Регистрирует перезапуск работающего вассала, не сопровождавшийся сменой состояния."""
+        self.respawns += 1
+
+    @property
+    def summary(self):
+        """Краткое описание жизненного цикла.
+
+        :returns: Словарь с текущим состоянием и счетчиками
+        :rtype: dict
+        """
+        return {
+            "state": self.__state__,
+            "since": self.__since__,
+            "starts": self.starts,
+            "failures": self.failures,
+            "respawns": self.respawns,
+            "last_start": self.__last_start__
+        }
+
+    @property
+    def dict(self):
+        """Полное описание жизненного цикла, включая историю переходов.
+
+        :returns: Словарь с описанием
+        :rtype: dict
+        """
+        data = self.summary
+        data["history"] = list(self.__history__)
+        return data
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Модуль описывает простые метрики, собираемые компонентами леса."""
+
+from __future__ import print_function, unicode_literals
+
+import math
+import time
+from bisect import bisect_left
+
+
+class DecayingCounter(object):
+
+    """Счетчик событий с экспоненциальным затуханием.
+
+    Значение счетчика приблизительно равно количеству событий за последние half_life секунд,
+    причем недавние события весят больше старых.
+    """
+
+    def __init__(self, half_life=300):
+        """Инициализирует счетчик.
+
+        :param half_life: Период полураспада значения в секундах
+        :type half_life: float
+        """
+        self.__decay__ = math.log(2) / half_life
+        self.__value__ = 0.0
+        self.__updated__ = time.time()
+
+    def __update__(self, now):
+        """Применяет затухание к значению счетчика.
+
+        :param now: Текущее время
+        :type now: float
+        """
+        self.__value__ *= math.exp(-self.__decay__ * max(0.0, now - self.__updated__))
+        self.__updated__ = now
+
+    def hit(self, count=1):
+        """Регистрирует событие.
+
+        :param count: Вес события
+        :type count: float
+        """
+        self.__update__(time.time())
+        self.__value__ += count
+
+    @property
+    def value(self):
+        """Текущее значение счетчика.
+
+        :returns: Значение счетчика с учетом затухания
+        :rtype: float
+        """
+        self.__update__(time.time())
+        return self.__value__
+
+
+class Histogram(object):
+
+    """Гистограмма длительностей с логарифмическими корзинами.
+
+    Границы корзин растут в 2 ** (1/4) раза, начиная с 10 мс, так что относительная погрешность
+    оценки перцентилей не превышает примерно 20%.
+    """
+
+    BOUNDS = tuple(0.01 * 2 ** (i / 4.0) for i in range(64))
+
+    def __init__(self):
+        """Инициализирует пустую гистограмму."""
+        self.__counts__ = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Добавляет значение в гистограмму.
+
+        :param value: Длительность в секундах
+        :type value: float
+        """
+        self.__counts__[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """Оценивает перцентиль с линейной интерполяцией внутри корзины.
+
+        :param q: Доля от 0 до 1
+        :type q: float
+        :returns: Оценка перцентиля или None для пустой гистограммы
+        :rtype: float
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+
+        for index, count in enumerate(self.__counts__):
+            if count and cumulative + count >= rank:
+                lower = max(self.BOUNDS[index - 1] if index else self.min, self.min)
+                upper = min(self.BOUNDS[index] if index < len(self.BOUNDS) else self.max, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+
+            cumulative += count
+
+        return self.max
+
+    @property
+    def summary(self):
+        """Краткое описание гистограммы.
+
+        :returns: Словарь с количеством значений, средним, экстремумами и перцентилями
+        :rtype: dict
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99)
+        }
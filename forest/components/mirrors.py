@@ -0,0 +1,50 @@
+# coding=utf-8
+"""Модуль описывает общий для видов кэш зеркал git-репозиториев."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import hashlib
+
+from toro import Lock
+
+
+class MirrorCache(object):
+
+    """Директория голых зеркал (git clone --mirror) репозиториев видов.
+
+    Для каждого url репозитория хранится одно зеркало, которое обновляется через git fetch и используется
+    как источник рабочих деревьев всех видов с этим url. Операции над зеркалом выполняются под блокировкой,
+    общей для всех видов, использующих репозиторий.
+    """
+
+    def __init__(self, directory):
+        """Инициализирует кэш.
+
+        :param directory: Директория зеркал
+        :type directory: str
+        """
+        self.__directory__ = directory
+        self.__locks__ = {}
+
+        if not os.path.exists(self.__directory__):
+            os.makedirs(self.__directory__)
+
+    def path(self, url):
+        """Возвращает путь к зеркалу репозитория.
+
+        :param url: URL репозитория
+        :type url: str
+        :returns: Полный путь к директории зеркала
+        :rtype: str
+        """
+        return os.path.join(self.__directory__, "{}.git".format(hashlib.sha1(url.encode("utf-8")).hexdigest()))
+
+    def lock(self, url):
+        """Возвращает блокировку зеркала репозитория.
+
+        :param url: URL репозитория
+        :type url: str
+        :rtype: Lock
+        """
+        return self.__locks__.setdefault(url, Lock())
@@ -0,0 +1,252 @@
+# coding=utf-8
+"""Модуль описывает реестр конфигураций вассалов, хранимый в памяти."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import hashlib
+
+from tornado.ioloop import IOLoop
+
+from forest.components.common import log_message
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class VassalRegistry(object):
+
+    """Реестр конфигураций вассалов.
+
+    Реестр считывает директорию конфигураций один раз при создании и далее является основным
+    источником сведений о вассалах: список имен и проверка наличия не обращаются к диску. Изменения,
+    выполненные через реестр, применяются сразу; изменения, внесенные в директорию извне, поступают
+    через inotify, если установлен pyinotify. Внешним считается изменение, отпечаток которого не
+    совпадает ни с текущим отпечатком, ни с отпечатками еще не примененных собственных изменений.
+    """
+
+    def __init__(self, directory, extension=".ini", on_change=None, watch=True):
+        """Инициализирует реестр.
+
+        :param directory: Директория конфигурационных файлов
+        :type directory: str
+        :param extension: Расширение конфигурационных файлов
+        :type extension: str
+        :param on_change: Функция, вызываемая при внешнем изменении конфигурации с именем вассала и новой
+                          конфигурацией (None при удалении)
+        :type on_change: function
+        :param watch: Отслеживать ли изменения директории через inotify
+        :type watch: bool
+        """
+        self.__directory__ = directory
+        self.__extension__ = extension
+        self.__on_change__ = on_change
+        self.__configs__ = {}
+        self.__hashes__ = {}
+        self.__expected__ = {}
+        self.__notifier__ = None
+
+        for filename in os.listdir(self.__directory__):
+            name = self.__vassal_name__(filename)
+            if name:
+                self.__load__(name)
+
+        if watch and pyinotify:
+            try:
+                manager = pyinotify.WatchManager()
+                manager.add_watch(
+                    self.__directory__,
+                    pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM,
+                    quiet=False
+                )
+                self.__notifier__ = pyinotify.TornadoAsyncNotifier(
+                    manager, IOLoop.current(), default_proc_fun=self.__event__
+                )
+            except (pyinotify.WatchManagerError, OSError) as e:
+                log_message(
+                    "WARNING: inotify is unavailable ({}), external vassal config changes "
+                    "in {} are not tracked".format(e, self.__directory__),
+                    "Emperor"
+                )
+        elif watch:
+            log_message(
+                "WARNING: pyinotify is not installed, external vassal config changes in {} are not tracked; "
+                "install it with 'pip install forest[inotify]'".format(self.__directory__),
+                "Emperor"
+            )
+
+    def __contains__(self, name):
+        """Проверяет наличие конфигурации вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :rtype: bool
+        """
+        return name in self.__configs__
+
+    def __iter__(self):
+        return iter(list(self.__configs__))
+
+    def __len__(self):
+        return len(self.__configs__)
+
+    @staticmethod
+    def fingerprint(config):
+        """Вычисляет отпечаток конфигурации.
+
+        :param config: Конфигурация вассала
+        :type config: str
+        :returns: Отпечаток конфигурации
+        :rtype: str
+        """
+        if not isinstance(config, bytes):
+            config = config.encode("utf-8")
+
+        return hashlib.sha1(config).hexdigest()
+
+    @property
+    def names(self):
+        """Список имен вассалов, конфигурации которых известны реестру.
+
+        :returns: Список имен вассалов
+        :rtype: list
+        """
+        return list(self.__configs__)
+
+    def get(self, name):
+        """Возвращает конфигурацию вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Конфигурация вассала или None
+        :rtype: str
+        """
+        return self.__configs__.get(name)
+
+    def get_fingerprint(self, name):
+        """Возвращает отпечаток конфигурации вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Отпечаток конфигурации или None
+        :rtype: str
+        """
+        return self.__hashes__.get(name)
+
+    def set(self, name, config):
+        """Сохраняет конфигурацию вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        :param config: Конфигурация вассала
+        :type config: str
+        """
+        self.__configs__[name] = config
+        self.__hashes__[name] = self.fingerprint(config)
+        self.__expect__(name, self.__hashes__[name])
+
+    def discard(self, name):
+        """Удаляет конфигурацию вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        self.__configs__.pop(name, None)
+        self.__hashes__.pop(name, None)
+        self.__expect__(name, None)
+
+    def __expect__(self, name, fingerprint):
+        """Запоминает собственное изменение, событие о котором еще не поступило.
+
+        :param name: Имя вассала
+        :type name: str
+        :param fingerprint: Отпечаток записанной конфигурации или None при удалении
+        :type fingerprint: str
+        """
+        if self.__notifier__:
+            self.__expected__.setdefault(name, set()).add(fingerprint)
+
+    def close(self):
+        """Прекращает отслеживание директории."""
+        if self.__notifier__:
+            self.__notifier__.stop()
+            self.__expected__ = {}
+        self.__notifier__ = None
+
+    def __vassal_name__(self, filename):
+        """Определяет имя вассала по имени файла.
+
+        :param filename: Имя файла
+        :type filename: str
+        :returns: Имя вассала или None для временных и посторонних файлов
+        :rtype: str
+        """
+        if filename.startswith(".") or not filename.endswith(self.__extension__):
+            return None
+
+        return filename[:-len(self.__extension__)]
+
+    def __load__(self, name):
+        """Считывает конфигурацию вассала с диска.
+
+        :param name: Имя вассала
+        :type name: str
+        :returns: Конфигурация вассала или None, если файл отсутствует
+        :rtype: str
+        """
+        try:
+            with open(os.path.join(self.__directory__, "{}{}".format(name, self.__extension__)), "r") as cfg:
+                config = cfg.read()
+        except (IOError, OSError):
+            return None
+
+        self.set(name, config)
+        return config
+
+    def __event__(self, event):
+        """Обрабатывает событие inotify.
+
+        :param event: Событие
+        :type event: pyinotify.Event
+        """
+        name = self.__vassal_name__(event.name or "")
+        if not name:
+            return
+
+        known = self.__hashes__.get(name)
+        expected = self.__expected__.get(name, ())
+
+        if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+            if os.path.exists(event.pathname) or known is None or None in expected:
+                if known is None:
+                    self.__expected__.pop(name, None)
+                return
+
+            self.discard(name)
+            log_message("Vassal config {} removed externally".format(name), "Emperor")
+            config = None
+        else:
+            try:
+                with open(event.pathname, "r") as cfg:
+                    config = cfg.read()
+            except (IOError, OSError):
+                return
+
+            fingerprint = self.fingerprint(config)
+
+            if fingerprint == known:
+                self.__expected__.pop(name, None)
+                return
+
+            if fingerprint in expected:
+                # Событие о собственной записи, уже замененной более новой конфигурацией
+                return
+
+            self.set(name, config)
+            self.__expected__.pop(name, None)
+            log_message("Vassal config {} changed externally".format(name), "Emperor")
+
+        if self.__on_change__:
+            self.__on_change__(name, config)
@@ -0,0 +1,153 @@
+# coding=utf-8
+"""Описывает клиент uwsgi-rpc, используемый для вызова rpc-функций вассалов."""
+
+from __future__ import print_function, unicode_literals
+
+from struct import pack, unpack
+
+import psutil
+from tornado.gen import coroutine, Return, with_timeout
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+
+from forest.components.common import connect
+
+
+# pylint: disable=W0612
+
+
+class RPCClient(object):
+
+    """Клиент uwsgi-rpc отдельного вассала.
+
+    Адрес сокета вассала определяется по открытым соединениям его мастер-процесса и кэшируется до смены pid.
+    uwsgi закрывает соединение после ответа на каждый запрос, поэтому переиспользуется только TCPClient,
+    а каждый вызов выполняется в собственном соединении.
+    """
+
+    class NotRunning(Exception):
+        pass
+
+    def __init__(self, tcp_client=None, timeout=5):
+        """Инициализирует клиент.
+
+        :param tcp_client: Используемый для подключений TCPClient
+        :type tcp_client: TCPClient
+        :param timeout: Таймаут вызова по умолчанию в секундах
+        :type timeout: float
+        """
+        self.__tcp_client__ = tcp_client or TCPClient()
+        self.__timeout__ = timeout
+        self.__pid__ = None
+        self.__address__ = None
+
+    def resolve(self, pid):
+        """Возвращает адрес сокета вассала, при необходимости определяя его заново.
+
+        :param pid: pid мастер-процесса вассала
+        :type pid: int
+        :returns: Хост и порт сокета
+        :rtype: tuple
+        :raise NotRunning: Процесс не найден или не слушает ни одного сокета
+        """
+        if pid != self.__pid__:
+            try:
+                connections = psutil.Process(pid).connections(kind="inet")
+            except psutil.NoSuchProcess:
+                raise self.NotRunning()
+
+            listening = [c.laddr for c in connections if c.status == psutil.CONN_LISTEN]
+            if not listening:
+                raise self.NotRunning()
+
+            self.__pid__ = pid
+            self.__address__ = tuple(listening[0])
+
+        return self.__address__
+
+    def invalidate(self):
+        """Сбрасывает кэшированный адрес сокета вассала."""
+        self.__pid__ = None
+        self.__address__ = None
+
+    MAX_SIZE = 65535
+
+    @classmethod
+    def pack(cls, args):
+        """Формирует пакет uwsgi-rpc одним буфером.
+
+        :param args: Имя функции и ее аргументы
+        :type args: list
+        :returns: Пакет uwsgi-rpc
+        :rtype: bytes
+        :raise ValueError: Аргументы не являются строками или не помещаются в пакет uwsgi-rpc
+        """
+        if not all(isinstance(arg, (bytes, type(""))) for arg in args):
+            raise ValueError("RPC arguments must be strings")
+
+        args = [arg if isinstance(arg, bytes) else arg.encode("utf-8") for arg in args]
+
+        if sum(2 + len(arg) for arg in args) > cls.MAX_SIZE:
+            raise ValueError("RPC arguments must not exceed {} bytes".format(cls.MAX_SIZE))
+
+        body = b"".join(pack("<H", len(arg)) + arg for arg in args)
+        return pack("<BHB", 173, len(body), 0) + body
+
+    @coroutine
+    def call(self, pid, *args, **kwargs):
+        """Вызывает rpc-функцию вассала.
+
+        :param pid: pid мастер-процесса вассала
+        :type pid: int
+        :param timeout: Таймаут вызова в секундах
+        :type timeout: float
+        :returns: Результат выполнения функции
+        :rtype: bytes
+        :raise NotRunning: Вассал не запущен
+        :raise StreamClosedError: Соединение закрыто до получения ответа
+        :raise TimeoutError: Вызов не завершился за отведенное время
+        :raise ValueError: Аргументы не помещаются в пакет uwsgi-rpc
+        """
+        deadline = IOLoop.current().time() + (kwargs.get("timeout") or self.__timeout__)
+        packet = self.pack(args)
+        host, port = self.resolve(pid)
+
+        try:
+            data = yield self.__exchange__(host, port, packet, deadline)
+        except Exception:
+            self.invalidate()
+            raise
+
+        raise Return(data)
+
+    @coroutine
+    def __exchange__(self, host, port, packet, deadline):
+        """Выполняет обмен данными с вассалом.
+
+        Подключение, запись и чтение ограничены deadline; соединение закрывается в любом случае.
+
+        :param host: Хост сокета вассала
+        :type host: str
+        :param port: Порт сокета вассала
+        :type port: int
+        :param packet: Отправляемый пакет
+        :type packet: bytes
+        :param deadline: Время IOLoop, до которого должен быть получен ответ
+        :type deadline: float
+        :returns: Тело ответа
+        :rtype: bytes
+        """
+        stream = yield connect(self.__tcp_client__, host, port, deadline)
+
+        try:
+            yield with_timeout(deadline, stream.write(packet), quiet_exceptions=StreamClosedError)
+
+            header = yield with_timeout(deadline, stream.read_bytes(4), quiet_exceptions=StreamClosedError)
+            modifier1, datasize, modifier2 = unpack("<BHB", header)
+
+            data = yield with_timeout(deadline, stream.read_bytes(datasize), quiet_exceptions=StreamClosedError)
+        finally:
+            stream.close()
+
+        raise Return(data)
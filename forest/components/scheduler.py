@@ -0,0 +1,175 @@
+# coding=utf-8
+"""Модуль описывает планировщик запуска вассалов."""
+
+from __future__ import print_function, unicode_literals
+
+import time
+import heapq
+import itertools
+import traceback
+from collections import deque
+from datetime import timedelta
+
+from tornado.gen import coroutine, sleep
+from tornado.ioloop import IOLoop
+from toro import Condition, Timeout
+
+
+# pylint: disable=W0702
+
+
+class StartScheduler(object):
+
+    """Планировщик, ограничивающий количество и частоту одновременных запусков вассалов.
+
+    Запуски ставятся в очередь и допускаются не чаще rate раз в секунду, при этом одновременно
+    запускающихся вассалов может быть не больше concurrency. Вассал занимает слот с момента допуска
+    до выхода из состояния запуска (см. release) или до истечения start_timeout. Из очереди первым
+    допускается вассал с наибольшим приоритетом на момент постановки в очередь, при равных приоритетах -
+    поставленный раньше.
+
+    Порядок допуска поддерживается кучей; записи отмененных и повторно поставленных в очередь вассалов
+    удаляются из нее лениво, при извлечении.
+    """
+
+    def __init__(self, concurrency=10, rate=10.0, start_timeout=60, history=100):
+        """Инициализирует планировщик.
+
+        :param concurrency: Максимальное количество одновременно запускающихся вассалов
+        :type concurrency: int
+        :param rate: Максимальное количество запусков в секунду
+        :type rate: float
+        :param start_timeout: Время в секундах, по истечении которого слот запуска освобождается принудительно
+        :type start_timeout: float
+        :param history: Количество последних времен ожидания, учитываемых в статистике
+        :type history: int
+        """
+        self.__concurrency__ = concurrency
+        self.__rate__ = rate
+        self.__start_timeout__ = start_timeout
+        self.__queue__ = {}
+        self.__heap__ = []
+        self.__sequence__ = itertools.count()
+        self.__active__ = {}
+        self.__waits__ = deque(maxlen=history)
+        self.__last_admission__ = 0
+        self.__condition__ = Condition()
+
+        IOLoop.current().spawn_callback(self.__run__)
+
+    def schedule(self, vassal, callback):
+        """Ставит запуск вассала в очередь.
+
+        Если вассал уже находится в очереди, его место сохраняется, а функция запуска заменяется новой.
+
+        :param vassal: Запускаемый вассал
+        :type vassal: Vassal
+        :param callback: Функция запуска; если она возвращает False, слот запуска сразу освобождается
+        :type callback: function
+        """
+        if vassal.id in self.__queue__:
+            enqueued, sequence = self.__queue__[vassal.id][2:4]
+        else:
+            enqueued, sequence = time.time(), next(self.__sequence__)
+
+        entry = [-vassal.priority, sequence, vassal.id]
+        self.__queue__[vassal.id] = (vassal, callback, enqueued, sequence, entry)
+        heapq.heappush(self.__heap__, entry)
+
+        if len(self.__heap__) > 2 * len(self.__queue__) + 100:
+            self.__heap__ = [_[4] for _ in self.__queue__.values()]
+            heapq.heapify(self.__heap__)
+
+        self.__condition__.notify_all()
+
+    def cancel(self, name):
+        """Удаляет вассала из очереди.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        self.__queue__.pop(name, None)
+
+        if not self.__queue__:
+            self.__heap__ = []
+
+    def release(self, name):
+        """Освобождает слот запуска вассала.
+
+        :param name: Имя вассала
+        :type name: str
+        """
+        if self.__active__.pop(name, None) is not None:
+            self.__condition__.notify_all()
+
+    @property
+    def stats(self):
+        """Статистика очереди запуска.
+
+        :returns: Словарь с глубиной очереди, количеством запускающихся вассалов и временами ожидания
+        :rtype: dict
+        """
+        now = time.time()
+        waits = list(self.__waits__)
+
+        return {
+            "queued": len(self.__queue__),
+            "active": len(self.__active__),
+            "concurrency": self.__concurrency__,
+            "rate": self.__rate__,
+            "oldest_wait": max([now - _[2] for _ in self.__queue__.values()] or [0]),
+            "wait": {
+                "count": len(waits),
+                "mean": sum(waits) / len(waits) if waits else 0,
+                "max": max(waits or [0])
+            }
+        }
+
+    def __expire__(self):
+        """Освобождает слоты вассалов, запуск которых длится дольше start_timeout."""
+        deadline = time.time() - self.__start_timeout__
+
+        for name, admitted in list(self.__active__.items()):
+            if admitted < deadline:
+                del self.__active__[name]
+
+    @coroutine
+    def __run__(self):
+        """Допускает вассалов из очереди с учетом ограничений."""
+        while True:
+            self.__expire__()
+
+            if not self.__queue__ or (self.__concurrency__ and len(self.__active__) >= self.__concurrency__):
+                try:
+                    yield self.__condition__.wait(deadline=timedelta(seconds=1))
+                except Timeout:
+                    pass
+                continue
+
+            if self.__rate__:
+                delay = self.__last_admission__ + 1.0 / self.__rate__ - time.time()
+                if delay > 0:
+                    yield sleep(delay)
+                    continue
+
+            entry = heapq.heappop(self.__heap__)
+            name = entry[2]
+
+            if name not in self.__queue__ or self.__queue__[name][4] is not entry:
+                continue
+
+            vassal, callback, enqueued = self.__queue__.pop(name)[:3]
+
+            now = time.time()
+            self.__last_admission__ = now
+            self.__waits__.append(now - enqueued)
+            self.__active__[name] = now
+
+            try:
+                admitted = callback(vassal)
+            except:
+                traceback.print_exc()
+                admitted = False
+
+            if admitted is False:
+                self.release(name)
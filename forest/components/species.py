@@ -4,19 +4,135 @@
 from __future__ import print_function, unicode_literals
 
 import os
+import glob
+import gzip
+import time
+import signal
+import multiprocessing
+from collections import deque
 from os.path import join
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-import tornado
+import tornado.process
 from tornado.gen import coroutine, Task, Return
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 from simplejson import JSONDecodeError
 
-from forest.components.common import log_message, dump, load
+from forest.components.common import log_message, dump, load, replace_symlink
 
 
 # pylint: disable=W0612,W0613
 
 
+STATIC_DEFAULTS = {
+    "url": "/static",
+    "path": "static",
+    "gzip": True,
+    "extensions": [".css", ".js", ".svg", ".html", ".json", ".xml", ".txt", ".eot", ".ttf", ".map"],
+    "min_size": 1024,
+    "hashed": r"\.[0-9a-f]{8,}\.[^/]+$",
+    "expires": 31536000,
+    "cache_paths": 60
+}
+
+
+VERSION_SLOTS = ("0", "1", "2")
+
+
+OUTPUT_TAIL = 100
+
+
+CACHE_DEFAULTS = {
+    "items": 1000,
+    "blocksize": 65536
+}
+
+
+def normalize_cache(cache):
+    """Проверяет правила кэширования ответов и дополняет их значениями по умолчанию.
+
+    Правила содержат размер кэша (items, blocksize) и список правил rules, каждое из которых задает
+    регулярное выражение пути path, время жизни ответа ttl в секундах и флаг vary_cookie, при котором
+    ответы кэшируются отдельно для каждого значения Cookie. Без этого флага кэшируются только запросы
+    без Cookie.
+
+    :param cache: Правила кэширования или None
+    :type cache: dict
+    :returns: Проверенные правила или None, если кэширование не используется
+    :rtype: dict
+    :raise ValueError: Правила некорректны
+    """
+    if not cache or not cache.get("rules"):
+        return None
+
+    normalized = dict(CACHE_DEFAULTS)
+    normalized.update((key, cache[key]) for key in CACHE_DEFAULTS if key in cache)
+    normalized["rules"] = []
+
+    for key in CACHE_DEFAULTS:
+        if isinstance(normalized[key], bool) or not isinstance(normalized[key], int) or normalized[key] < 1:
+            raise ValueError("Cache {} must be a positive integer".format(key))
+
+    for rule in cache["rules"]:
+        if not isinstance(rule, dict) or not rule.get("path"):
+            raise ValueError("Cache rule must define a path")
+
+        ttl = rule.get("ttl", 60)
+        if isinstance(ttl, bool) or not isinstance(ttl, int) or ttl < 1:
+            raise ValueError("Cache rule ttl must be a positive integer")
+
+        normalized["rules"].append({
+            "path": rule["path"],
+            "ttl": ttl,
+            "vary_cookie": bool(rule.get("vary_cookie", False))
+        })
+
+    return normalized
+
+
+def precompress(directory, extensions, min_size):
+    """Создает рядом со статическими файлами их сжатые gzip версии.
+
+    Сжатая версия пересоздается, только если она старше исходного файла. Время модификации сжатой
+    версии совпадает со временем модификации исходного файла.
+
+    :param directory: Директория статических файлов
+    :type directory: str
+    :param extensions: Расширения сжимаемых файлов
+    :type extensions: list
+    :param min_size: Минимальный размер сжимаемого файла в байтах
+    :type min_size: int
+    :returns: Количество сжатых файлов
+    :rtype: int
+    """
+    compressed = 0
+
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            path = join(root, name)
+
+            if not name.endswith(tuple(extensions)) or os.path.getsize(path) < min_size:
+                continue
+
+            stat = os.stat(path)
+            if os.path.exists(path + ".gz") and int(os.stat(path + ".gz").st_mtime) >= int(stat.st_mtime):
+                continue
+
+            with open(path, "rb") as source:
+                target = gzip.GzipFile(path + ".gz", "wb", 9, mtime=stat.st_mtime)
+                try:
+                    shutil.copyfileobj(source, target)
+                finally:
+                    target.close()
+
+            os.utime(path + ".gz", (stat.st_atime, stat.st_mtime))
+            compressed += 1
+
+    return compressed
+
+
 class Species(object):
 
     """Класс, представляющий вид листа - совокупность исходного кода и виртуального окружения python."""
@@ -24,6 +140,9 @@ class Species(object):
     class NotDefined(Exception):
         pass
 
+    class BuildError(Exception):
+        pass
+
     def __init__(
             self,
             _id,
@@ -32,6 +151,16 @@ class Species(object):
             directory,
             interpreter=None,
             branch="master",
+            static=None,
+            cache=None,
+            wheelhouse=None,
+            environments=None,
+            mirrors=None,
+            on_build_event=None,
+            step_timeout=None,
+            compile_processes=None,
+            metadata_mtime=None,
+            versions_in_use=None,
             **kwargs):
         """Инициализирует объект.
 
@@ -47,20 +176,66 @@ class Species(object):
         :type interpreter: str
         :param branch: Ветвь репозитория (при использовании git)
         :type branch: str
+        :param static: Настройки отдачи статических файлов (см. Species.static)
+        :type static: dict
+        :param cache: Правила кэширования ответов листьев вида (см. normalize_cache)
+        :type cache: dict
+        :param wheelhouse: Общий кэш wheel-пакетов ветви
+        :type wheelhouse: Wheelhouse
+        :param environments: Общее хранилище виртуальных окружений ветви
+        :type environments: EnvironmentStore
+        :param mirrors: Общий кэш зеркал git-репозиториев ветви
+        :type mirrors: MirrorCache
+        :param on_build_event: Функция, вызываемая с каждым событием сборки (см. Species.run_in_env)
+        :type on_build_event: function
+        :param step_timeout: Максимальная длительность шага сборки в секундах, по истечении которой процесс
+                             шага принудительно завершается; None отключает ограничение
+        :type step_timeout: float
+        :param compile_processes: Количество процессов компиляции байт-кода; по умолчанию половина ядер
+        :type compile_processes: int
+        :param metadata_mtime: Время модификации файла метаданных, из которого восстанавливается вид; если
+                               указано, файл метаданных не читается, а вид считается собранным при наличии
+                               текущей версии
+        :type metadata_mtime: float
+        :param versions_in_use: Функция, возвращающая по виду множество путей его версий (относительно корневой
+                                директории вида), на которые ссылаются записанные конфигурации листьев; такие
+                                версии не используются для сборки (см. Species.version_path)
+        :type versions_in_use: function
+        :raise ValueError: Правила кэширования некорректны
         """
         self.directory = directory
         self.specie_id = _id
         self.interpreter = interpreter if interpreter in ["python2", "python3"] else "python2"
         self.url = url
         self.branch = branch
+        self.__static__ = static or {}
+        self.__cache__ = cache
+        self.cache = normalize_cache(cache)
+        self.wheelhouse = wheelhouse
+        self.environments = environments
+        self.mirrors = mirrors
+        self.__on_build_event__ = on_build_event
+        self.__versions_in_use__ = versions_in_use
+        self.__step_timeout__ = step_timeout
+        self.__compile_processes__ = compile_processes or max(1, multiprocessing.cpu_count() // 2)
+        self.__build_root__ = None
 
         if not os.path.exists(self.path):
             os.makedirs(self.path)
 
+        if not os.path.lexists(self.current_path) and os.path.exists(os.path.join(self.path, "src")):
+            # Вид собран до появления версий: его исходный код и окружение становятся текущей версией на месте
+            os.symlink(".", self.current_path)
+
         self.modified = modified
 
-        self.__ready__ = self.modified == self.saved_data.get("modified")
-        self.update_saved_data()
+        # Файл метаданных записывается только после сборки версии, поэтому описывает текущую версию вида
+        if metadata_mtime is not None:
+            self.__ready__ = os.path.exists(self.current_path)
+            self.__metadata_mtime__ = metadata_mtime
+        else:
+            self.__ready__ = self.modified == self.saved_data.get("modified") and os.path.exists(self.current_path)
+            self.__metadata_mtime__ = os.stat(join(self.path, "metadata.json")).st_mtime if self.__ready__ else None
 
     @property
     def is_ready(self):
@@ -115,41 +290,269 @@ class Species(object):
         except (IOError, JSONDecodeError):
             return {}
 
-    def update_saved_data(self):
-        """Обновляет сохраненные настройки вида актуальными данными."""
-        data = {
+    @property
+    def metadata(self):
+        """Настройки вида, сохраняемые в файле метаданных.
+
+        :returns: Словарь с настройками вида
+        :rtype: dict
+        """
+        return {
             "_id": self.id,
             "url": self.url,
             "modified": self.modified,
             "interpreter": self.interpreter,
             "branch": self.branch,
+            "static": self.__static__,
+            "cache": self.__cache__
         }
 
+    @property
+    def metadata_mtime(self):
+        """Время модификации файла метаданных, описывающего этот объект.
+
+        :returns: Время модификации или None, если метаданные объекта еще не записаны
+        :rtype: float
+        """
+        return self.__metadata_mtime__
+
+    def update_saved_data(self):
+        """Обновляет сохраненные настройки вида актуальными данными.
+
+        Вызывается после переключения на собранную версию: вид, метаданные которого совпадают с
+        сохраненными, считается собранным.
+        """
         with open(join(self.path, "metadata.json"), 'w') as f:
-            dump(data, f)
+            dump(self.metadata, f)
+
+        self.__metadata_mtime__ = os.stat(join(self.path, "metadata.json")).st_mtime
+
+    @property
+    def static(self):
+        """Настройки отдачи статических файлов вида, дополненные значениями по умолчанию.
+
+        Настройки включают url и путь к статическим файлам относительно исходного кода, флаг и параметры
+        предварительного сжатия gzip, регулярное выражение имен файлов с хэшем содержимого, время
+        кэширования таких файлов клиентом и время кэширования путей к файлам в uwsgi.
+
+        :returns: Словарь настроек статики
+        :rtype: dict
+        """
+        static = dict(STATIC_DEFAULTS)
+        static.update(self.__static__)
+        return static
+
+    @property
+    def static_path(self):
+        """Полный путь к директории статических файлов вида.
+
+        :returns: Полный путь к директории статики
+        :rtype: str
+        """
+        return os.path.join(self.src_path, self.static["path"])
+
+    @property
+    def current_path(self):
+        """Путь к ссылке на текущую версию вида, используемую листьями.
+
+        :returns: Полный путь к ссылке
+        :rtype: str
+        """
+        return os.path.join(self.path, "current")
+
+    @property
+    def previous_path(self):
+        """Путь к ссылке на предыдущую версию вида, сохраняемую для отката.
+
+        :returns: Полный путь к ссылке
+        :rtype: str
+        """
+        return os.path.join(self.path, "previous")
+
+    @property
+    def version_path(self):
+        """Путь к директории текущей версии вида с разрешенной ссылкой current.
+
+        Листья используют в конфигурации этот путь, а не ссылку, поэтому переключение версии меняет
+        их конфигурацию, а воркеры, запущенные с прежней конфигурацией, продолжают работать с прежней версией.
+
+        :returns: Полный путь к директории текущей версии
+        :rtype: str
+        """
+        version = self.versions["current"]
+        return os.path.normpath(os.path.join(self.path, version)) if version else self.current_path
+
+    @property
+    def versions(self):
+        """Текущая и предыдущая версии вида.
+
+        :returns: Словарь путей версий относительно корневой директории вида (None, если версии нет)
+        :rtype: dict
+        """
+        return {
+            "current": self.__version__(self.current_path),
+            "previous": self.__version__(self.previous_path)
+        }
+
+    @staticmethod
+    def __version__(link):
+        """Возвращает версию, на которую указывает ссылка.
+
+        :param link: Путь к ссылке
+        :type link: str
+        :returns: Путь версии относительно корневой директории вида или None
+        :rtype: str
+        """
+        return os.readlink(link) if os.path.islink(link) else None
+
+    @property
+    def build_path(self):
+        """Путь к собираемой версии вида; вне сборки совпадает с путем текущей версии.
+
+        :returns: Полный путь к директории версии
+        :rtype: str
+        """
+        return self.__build_root__ or self.current_path
+
+    @property
+    def build_src_path(self):
+        """Путь к исходному коду собираемой версии вида.
+
+        :returns: Полный путь к директории исходного кода
+        :rtype: str
+        """
+        return os.path.join(self.build_path, "src")
+
+    @property
+    def build_environment(self):
+        """Путь к виртуальному окружению собираемой версии вида.
+
+        :returns: Полный путь к директории виртуального окружения
+        :rtype: str
+        """
+        return os.path.join(self.build_path, "env")
+
+    def rollback(self):
+        """Меняет местами текущую и предыдущую версии вида.
+
+        :returns: Флаг выполнения отката; False, если предыдущей версии нет
+        :rtype: bool
+        """
+        versions = self.versions
+
+        if not versions["previous"] or not versions["current"]:
+            return False
+
+        replace_symlink(versions["previous"], self.current_path)
+        replace_symlink(versions["current"], self.previous_path)
+        log_message("Rolled back {} to {}".format(self.id, versions["previous"]), "Species")
+
+        return True
+
+    def __allocate_version__(self):
+        """Выбирает директорию для сборки новой версии.
+
+        Используется слот, не занятый ни текущей, ни предыдущей версией, ни версией, на которую еще ссылаются
+        конфигурации листьев. Оставшееся в нем рабочее дерево устаревшей версии обновляется при сборке,
+        а не создается заново.
+
+        :returns: Путь версии относительно корневой директории вида
+        :rtype: str
+        :raise BuildError: Все слоты заняты
+        """
+        active = set(self.versions.values())
+        if self.__versions_in_use__:
+            active.update(self.__versions_in_use__(self))
+
+        version = next((_ for _ in (os.path.join("versions", slot) for slot in VERSION_SLOTS) if _ not in active), None)
+
+        if not version:
+            raise self.BuildError("No free version slot for {}, all versions are used by leaves".format(self.id))
+
+        if not os.path.exists(os.path.join(self.path, version)):
+            os.makedirs(os.path.join(self.path, version))
+
+        return version
+
+    def __activate__(self, version):
+        """Атомарно делает собранную версию текущей, а прежнюю текущую - предыдущей.
+
+        :param version: Путь версии относительно корневой директории вида
+        :type version: str
+        """
+        versions = self.versions
+
+        replace_symlink(version, self.current_path)
+        if versions["current"]:
+            replace_symlink(versions["current"], self.previous_path)
+
+        if versions["previous"] == ".":
+            # Версия, собранная до появления версий, больше не используется
+            if os.path.islink(os.path.join(self.path, "env")):
+                os.remove(os.path.join(self.path, "env"))
+            for name in ("src", "env"):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            if self.environments:
+                self.environments.release(self.id)
 
     @coroutine
     def initialize(self):
-        """Инициализирует корневую директорию вида.
+        """Собирает новую версию вида.
+
+        Версия собирается в отдельной директории, пока листья продолжают использовать текущую версию.
+        Сборка включает в себя следующие шаги:
 
-        Инициализация включает в себя следующие шаги:
+        1. Создание директории исходного кода из используемого хранилища
+        2. Создание нового виртуального окружения
+        3. Установка пакетов в новое виртуальное окружение
+        4. Компиляция исходного кода и пакетов в байт-код (см. Species.compile_bytecode)
+        5. Предварительное сжатие статических файлов
+        6. Переключение ссылки current на собранную версию и запись файла метаданных
 
-        1. Удаление имеющейся директории исходного кода
-        2. Создание директории исходного кода из используемого хранилища
-        3. Удаление имеющегося виртуального окружения
-        4. Создание нового виртуального окружения
-        5. Установка пакетов в новое виртуальное окружение
+        Прежняя текущая версия сохраняется как предыдущая (см. Species.rollback). При наличии кэша зеркал
+        первый шаг обновляет рабочее дерево, оставшееся в директории устаревшей версии
+        (см. Species.update_sources). При наличии хранилища окружений шаги 2-3 выполняются, только если
+        в хранилище нет собранного окружения для текущих интерпретатора и requirements.txt
+        (см. Species.initialize_shared_environment).
 
         В ходе установки пакетов в виртуальное окружение предполагается, что список пакетов будет описан в
-        файле requirements.txt, находящемся в корне директории с исходным кодом.
+        файле requirements.txt, находящемся в корне директории с исходным кодом. Если виду передан кэш
+        wheel-пакетов, пакеты устанавливаются через него (см. Species.install_requirements).
 
         .. note::
             В данный момент в качестве хранилища исходного кода поддерживается только git, с возможностью указания
             используемой ветви
+
+        :raise BuildError: Не удалось получить исходный код или установить пакеты; текущая версия не меняется
         """
         if not self.is_ready:
-            if os.path.exists(self.src_path):
-                shutil.rmtree(self.src_path)
+            version = self.__allocate_version__()
+            self.__build_root__ = os.path.join(self.path, version)
+
+            log_message("Building {} in {}".format(self.id, version), "Species")
+            started = time.time()
+
+            try:
+                yield self.__build__()
+            except Exception as e:
+                self.__build_event__("build", "failed", version=version, duration=time.time() - started, error=str(e))
+                raise
+            finally:
+                self.__build_root__ = None
+
+            self.__activate__(version)
+            self.update_saved_data()
+            self.__build_event__("build", "finished", version=version, duration=time.time() - started)
+            log_message("Done initializing {}".format(self.id), "Species")
+
+    @coroutine
+    def __build__(self):
+        """Выполняет шаги сборки версии в директории build_path."""
+        if self.mirrors:
+            yield self.update_sources()
+        else:
+            if os.path.exists(self.build_src_path):
+                shutil.rmtree(self.build_src_path)
 
             log_message("Initializing sources for {}".format(self.id), "Species")
 
@@ -159,42 +562,284 @@ class Species(object):
                 "--depth", "1",
                 "--branch", self.branch,
                 self.url,
-                self.src_path
+                self.build_src_path
                 ],
-                apply_env=False
+                apply_env=False,
+                step="sources"
             )
 
-            if os.path.exists(self.environment):
-                shutil.rmtree(self.environment)
+        if not os.path.isdir(self.build_src_path):
+            raise self.BuildError("Failed to get sources of {}".format(self.id))
 
-            log_message("Creating virtualenv for species {}".format(self.id), "Species")
+        if self.environments:
+            installed = yield self.initialize_shared_environment()
+        else:
+            if os.path.islink(self.build_environment):
+                os.remove(self.build_environment)
+            elif os.path.exists(self.build_environment):
+                shutil.rmtree(self.build_environment)
 
-            yield self.run_in_env([
-                "virtualenv",
-                "--python={}".format(self.python),
-                self.environment
-                ],
-                apply_env=False
+            installed = yield self.create_environment(self.build_environment)
+
+        if not installed:
+            raise self.BuildError("Failed to install requirements of {}".format(self.id))
+
+        yield self.compile_bytecode(environment=not self.environments)
+
+        static_path = os.path.join(self.build_src_path, self.static["path"])
+
+        if self.static["gzip"] and os.path.isdir(static_path):
+            log_message("Precompressing static files for {}".format(self.id), "Species")
+            started = time.time()
+
+            executor = ThreadPoolExecutor(1)
+            try:
+                compressed = yield executor.submit(
+                    precompress, static_path, self.static["extensions"], self.static["min_size"]
+                )
+            finally:
+                executor.shutdown(wait=False)
+
+            self.__build_event__("precompress", "finished", duration=time.time() - started, files=compressed)
+            log_message("Compressed {} static files for {}".format(compressed, self.id), "Species")
+
+    @coroutine
+    def compile_bytecode(self, sources=True, environment=True):
+        """Компилирует исходный код вида и пакеты виртуального окружения в байт-код.
+
+        Без этого .pyc-файлы создаются при первом импорте в каждом новом процессе uwsgi, и процессы
+        одновременно конкурируют за их запись. Компиляция выполняется интерпретатором окружения,
+        чтобы байт-код соответствовал его версии. Файлы и директории верхнего уровня src и site-packages
+        распределяются между compile_processes процессами compileall, запускаемыми с пониженным
+        приоритетом, чтобы сборка не отнимала процессор у листьев. Ошибки компиляции отдельных файлов
+        (например, несовместимых с версией интерпретатора) не прерывают сборку.
+
+        :param sources: Компилировать ли исходный код
+        :type sources: bool
+        :param environment: Компилировать ли пакеты виртуального окружения
+        :type environment: bool
+        """
+        directories = [self.build_src_path] if sources else []
+        targets = []
+
+        if environment:
+            directories.extend(glob.glob(os.path.join(self.build_environment, "lib", "python*", "site-packages")))
+
+        for directory in directories:
+            targets.extend(
+                os.path.join(directory, _) for _ in sorted(os.listdir(directory)) if not _.startswith(".")
             )
 
-            log_message("Installing virtualenv requirements for {}".format(self.id), "Species")
+        if not targets:
+            return
 
-            yield self.run_in_env([
-                os.path.join(self.environment, "bin/pip"),
-                "install",
-                "-r",
-                os.path.join(self.src_path, "requirements.txt"),
-                "--upgrade"
-            ])
+        processes = min(self.__compile_processes__, len(targets))
+        python = os.path.join(self.build_environment, "bin", "python")
 
-            log_message("Done initializing {}".format(self.id), "Species")
+        log_message("Compiling bytecode for {} in {} processes".format(self.id, processes), "Species")
+        started = time.time()
+
+        yield [
+            self.run_in_env(
+                ["nice", "-n", "10", python, "-m", "compileall", "-q"] + targets[i::processes], step="compile"
+            )
+            for i in range(processes)
+        ]
+
+        self.__build_event__("compile", "total", duration=time.time() - started, processes=processes)
+        log_message("Compiled bytecode for {} in {:.1f}s".format(self.id, time.time() - started), "Species")
+
+    @coroutine
+    def update_sources(self):
+        """Обновляет исходный код вида через зеркало репозитория.
+
+        Зеркало создается при первом использовании url и далее обновляется через git fetch, так что из сети
+        загружаются только новые объекты. Рабочее дерево вида клонируется из зеркала один раз, а при
+        обновлениях получает изменения из него, принудительно переключается на ветвь вида и очищается
+        от всех неотслеживаемых файлов, включая игнорируемые (например, .pyc удаленных модулей). Если зеркало
+        не удалось обновить, используется его текущее состояние. Если не удалось обновить рабочее дерево,
+        оно клонируется заново.
+        """
+        mirror = self.mirrors.path(self.url)
+
+        with (yield self.mirrors.lock(self.url).acquire()):
+            try:
+                if os.path.exists(mirror):
+                    log_message("Fetching {} for {}".format(self.url, self.id), "Species")
+                    yield self.run_in_env(
+                        ["git", "--git-dir", mirror, "fetch", "--prune", "origin"],
+                        apply_env=False, check=True, step="mirror"
+                    )
+                else:
+                    log_message("Mirroring {} for {}".format(self.url, self.id), "Species")
+                    yield self.run_in_env(
+                        ["git", "clone", "--mirror", self.url, mirror], apply_env=False, check=True, step="mirror"
+                    )
+            except self.BuildError as e:
+                log_message("Failed to update mirror of {}: {}".format(self.url, e), "Species")
+
+            if os.path.exists(os.path.join(self.build_src_path, ".git")):
+                log_message("Updating sources for {}".format(self.id), "Species")
+
+                try:
+                    for cmd in [
+                        ["remote", "set-url", "origin", mirror],
+                        ["fetch", "--prune", "origin"],
+                        ["checkout", "--force", "-B", self.branch, "origin/{}".format(self.branch)],
+                        ["clean", "-ffdx"]
+                    ]:
+                        yield self.run_in_env(
+                            ["git", "-C", self.build_src_path] + cmd, apply_env=False, check=True, step="sources"
+                        )
+                except self.BuildError as e:
+                    log_message("Failed to update sources for {}, cloning: {}".format(self.id, e), "Species")
+                else:
+                    return
+
+            if os.path.exists(self.build_src_path):
+                shutil.rmtree(self.build_src_path)
+
+            log_message("Initializing sources for {}".format(self.id), "Species")
+
+            yield self.run_in_env(
+                ["git", "clone", "--branch", self.branch, mirror, self.build_src_path], apply_env=False, step="sources"
+            )
+
+    @coroutine
+    def create_environment(self, path, link=None):
+        """Создает виртуальное окружение и устанавливает в него пакеты вида.
+
+        :param path: Директория создаваемого окружения
+        :type path: str
+        :param link: Функция, вызываемая после создания окружения, до установки пакетов
+        :type link: function
+        :returns: Флаг успешной установки пакетов
+        :rtype: bool
+        """
+        log_message("Creating virtualenv for species {}".format(self.id), "Species")
+
+        yield self.run_in_env([
+            "virtualenv",
+            "--python={}".format(self.python),
+            path
+            ],
+            apply_env=False,
+            step="virtualenv"
+        )
+
+        if link:
+            link()
+
+        log_message("Installing virtualenv requirements for {}".format(self.id), "Species")
+
+        installed = yield self.install_requirements()
+        raise Return(installed)
+
+    @coroutine
+    def initialize_shared_environment(self):
+        """Подключает виду окружение из общего хранилища, собирая его при необходимости.
+
+        Пакеты нового окружения компилируются в байт-код до того, как оно отмечается собранным, поэтому
+        повторно используемое окружение не компилируется заново. Окружение, сборка которого не удалась,
+        не отмечается собранным и будет пересобрано при следующей инициализации любого вида с теми же
+        зависимостями. Ссылки на окружения учитываются для каждой
+        версии вида, поэтому окружение предыдущей версии сохраняется до ее вытеснения.
+
+        :returns: Флаг успешной установки пакетов
+        :rtype: bool
+        """
+        store = self.environments
+        key = store.key(self.python, os.path.join(self.build_src_path, "requirements.txt"))
+        owner = os.path.relpath(self.build_path, self.directory)
+        installed = True
+
+        with (yield store.lock(key).acquire()):
+            if store.is_ready(key):
+                store.link(key, owner, self.build_environment)
+                log_message("Reusing environment {} for {}".format(key, self.id), "Species")
+            else:
+                store.prepare(key)
+
+                installed = yield self.create_environment(
+                    store.path(key), link=lambda: store.link(key, owner, self.build_environment)
+                )
+
+                if installed:
+                    yield self.compile_bytecode(sources=False)
+                    store.mark_ready(key)
+
+        IOLoop.current().spawn_callback(store.collect)
+        raise Return(installed)
+
+    @coroutine
+    def install_requirements(self):
+        """Устанавливает пакеты из requirements.txt в виртуальное окружение вида.
+
+        При наличии кэша wheel-пакетов недостающие пакеты сначала собираются в кэш, а затем устанавливаются
+        только из него. Пакеты собираются во временную директорию сборки и затем переносятся в кэш, поэтому
+        несколько видов могут устанавливать пакеты одновременно. Если собрать пакеты не удалось (например,
+        нет доступа к сети), установка все равно выполняется из кэша; если и она не удалась, пакеты
+        устанавливаются напрямую из индекса. После установки кэш отмечает использованные пакеты, а после
+        завершения последней использующей его сборки вытесняет давно не использовавшиеся.
+
+        :returns: Флаг успешной установки
+        :rtype: bool
+        """
+        pip = os.path.join(self.build_environment, "bin/pip")
+        requirements = os.path.join(self.build_src_path, "requirements.txt")
+
+        if self.wheelhouse:
+            wheels = self.wheelhouse.directory
+            staging = self.wheelhouse.stage()
+
+            try:
+                try:
+                    yield self.run_in_env([pip, "install", "--find-links", wheels, "wheel"], check=True, step="wheels")
+                    yield self.run_in_env(
+                        [pip, "wheel", "--wheel-dir", staging, "--find-links", wheels, "-r", requirements],
+                        check=True,
+                        step="wheels"
+                    )
+                except self.BuildError as e:
+                    log_message("Failed to build wheels for {}, trying offline: {}".format(self.id, e), "Species")
+
+                self.wheelhouse.publish(staging)
+
+                try:
+                    yield self.run_in_env(
+                        [pip, "install", "--no-index", "--find-links", wheels, "-r", requirements],
+                        check=True,
+                        step="requirements"
+                    )
+                except self.BuildError as e:
+                    log_message("Failed to install {} from wheelhouse: {}".format(self.id, e), "Species")
+                else:
+                    frozen, error = yield self.run_in_env([pip, "freeze"], step="freeze", capture=True)
+                    used = self.wheelhouse.mark_used(frozen.decode("utf-8").splitlines())
+                    log_message("Installed {} packages for {} from wheelhouse".format(used, self.id), "Species")
+                    raise Return(True)
+            finally:
+                self.wheelhouse.release(staging)
+
+        try:
+            yield self.run_in_env([pip, "install", "-r", requirements, "--upgrade"], check=True, step="requirements")
+        except self.BuildError as e:
+            log_message("Failed to install requirements for {}: {}".format(self.id, e), "Species")
+            raise Return(False)
+
+        raise Return(True)
 
     @coroutine
-    def run_in_env(self, cmd, stdin_data=None, env=None, apply_env=True):
+    def run_in_env(self, cmd, stdin_data=None, env=None, apply_env=True, check=False, step=None, capture=False):
         """Wrapper around subprocess call using Tornado's Subprocess class.
 
         https://gist.github.com/FZambia/5756470
 
+        Вывод процесса построчно передается как события сборки (см. Species.__build_event__) с шагом step:
+        started при запуске, output для каждой строки stdout и stderr и finished с кодом завершения и
+        длительностью. Процесс запускается в отдельной группе, которая целиком завершается, если шаг длится
+        дольше step_timeout.
+
         :param cmd: Исполняемая команда
         :type cmd: list
         :param stdin_data: Входные данные процесса на stdin
@@ -203,36 +848,127 @@ class Species(object):
         :type env: dict
         :param apply_env: Флаг применения локального окружения
         :type apply_env: bool
+        :param check: Проверять ли код завершения процесса
+        :type check: bool
+        :param step: Шаг сборки; по умолчанию имя исполняемого файла
+        :type step: str
+        :param capture: Возвращать ли весь вывод на stdout; иначе возвращаются только последние строки
+        :type capture: bool
+        :returns: Вывод процесса на stdout и последние строки вывода на stderr
+        :rtype: tuple
+        :raise BuildError: Процесс завершился с ненулевым кодом (только при check) или превысил step_timeout
         """
+        step = step or os.path.basename(cmd[0])
         process_env = os.environ.copy()
 
         if apply_env:
-            process_env["PATH"] = join(self.environment, "bin") + ":" + process_env.get("PATH", "")
-            process_env["VIRTUAL_ENV"] = self.environment
+            process_env["PATH"] = join(self.build_environment, "bin") + ":" + process_env.get("PATH", "")
+            process_env["VIRTUAL_ENV"] = self.build_environment
 
         if env:
             process_env.update(env)
 
+        tornado.process.Subprocess.initialize()
+
         sub_process = tornado.process.Subprocess(
             cmd,
             env=process_env,
             cwd=self.path,
             stdin=tornado.process.Subprocess.STREAM,
             stdout=tornado.process.Subprocess.STREAM,
-            stderr=tornado.process.Subprocess.STREAM
+            stderr=tornado.process.Subprocess.STREAM,
+            preexec_fn=os.setsid
         )
 
-        if stdin_data:
-            yield Task(sub_process.stdin.write, stdin_data)
-            sub_process.stdin.close()
+        started = time.time()
+        timed_out = []
+        self.__build_event__(step, "started", command=" ".join(cmd))
 
-        result, error = yield [
-            Task(sub_process.stdout.read_until_close),
-            Task(sub_process.stderr.read_until_close)
-        ]
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(sub_process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        timeout = IOLoop.current().call_later(self.__step_timeout__, kill) if self.__step_timeout__ else None
+
+        try:
+            if stdin_data:
+                yield Task(sub_process.stdin.write, stdin_data)
+                sub_process.stdin.close()
+
+            result, error = yield [
+                self.__read_output__(step, "stdout", sub_process.stdout, capture),
+                self.__read_output__(step, "stderr", sub_process.stderr)
+            ]
+
+            code = yield sub_process.wait_for_exit(raise_error=False)
+        finally:
+            if timeout:
+                IOLoop.current().remove_timeout(timeout)
+
+        self.__build_event__(step, "finished", code=code, duration=time.time() - started, timed_out=bool(timed_out))
+
+        if timed_out:
+            raise self.BuildError("{} step timed out after {} seconds".format(step, self.__step_timeout__))
+
+        if check and code != 0:
+            raise self.BuildError("{} exited with code {}: {}".format(
+                cmd[0], code, error.decode("utf-8", "replace").strip()[-1000:]
+            ))
 
         raise Return((result, error))
 
+    @coroutine
+    def __read_output__(self, step, name, stream, capture=False):
+        """Построчно читает вывод процесса, передавая строки как события сборки.
+
+        :param step: Шаг сборки
+        :type step: str
+        :param name: Имя потока вывода
+        :type name: str
+        :param stream: Поток вывода
+        :type stream: IOStream
+        :param capture: Сохранять ли весь вывод; иначе сохраняются только последние OUTPUT_TAIL строк
+        :type capture: bool
+        :returns: Сохраненный вывод
+        :rtype: bytes
+        """
+        lines = [] if capture else deque(maxlen=OUTPUT_TAIL)
+        pending = b""
+
+        while True:
+            try:
+                chunk = yield stream.read_bytes(65536, partial=True)
+            except StreamClosedError:
+                break
+
+            parts = (pending + chunk).split(b"\n")
+            pending = parts.pop()
+
+            for line in parts:
+                lines.append(line)
+                self.__build_event__(step, "output", stream=name, message=line.decode("utf-8", "replace"))
+
+        if pending:
+            lines.append(pending)
+            self.__build_event__(step, "output", stream=name, message=pending.decode("utf-8", "replace"))
+
+        raise Return(b"\n".join(lines))
+
+    def __build_event__(self, step, event, **data):
+        """Передает событие сборки функции on_build_event.
+
+        :param step: Шаг сборки
+        :type step: str
+        :param event: Тип события
+        :type event: str
+        """
+        if self.__on_build_event__:
+            data.update({"species": str(self.id), "step": step, "event": event})
+            self.__on_build_event__(data)
+
     @property
     def path(self):
         """Возвращает полный путь к корневой директории вида.
@@ -244,21 +980,21 @@ class Species(object):
 
     @property
     def src_path(self):
-        """Путь к директории с исходными кодами вида (обычно root/src).
+        """Путь к директории с исходными кодами текущей версии вида (root/versions/<slot>/src).
 
         :returns: Полынй путь к директории исходных кодов
         :rtype: str
         """
-        return os.path.join(self.path, "src")
+        return os.path.join(self.version_path, "src")
 
     @property
     def environment(self):
-        """Возвращает полный путь к директории виртуального окржения вида (обычно root/env).
+        """Возвращает полный путь к директории виртуального окржения текущей версии вида (root/versions/<slot>/env).
 
         :returns: Полный путь к директории виртуального окружения
         :rtype: str
         """
-        return os.path.join(self.path, "env")
+        return os.path.join(self.version_path, "env")
 
     @property
     def id(self):
@@ -49,7 +49,7 @@ class Trunk(tornado.web.Application):
         self.druid = None
         self.air = None
 
-        self.emperor = Emperor(self.emperor_dir)
+        self.emperor = Emperor(self.emperor_dir, **settings.get("emperor_settings", {}))
 
     @property
     def id(self):
@@ -0,0 +1,205 @@
+# coding=utf-8
+"""Модуль описывает общий для ветви кэш собранных wheel-пакетов."""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import re
+import time
+import shutil
+import tempfile
+
+from simplejson import JSONDecodeError
+
+from forest.components.common import log_message, dump, load
+
+
+class Wheelhouse(object):
+
+    """Директория wheel-пакетов, собранных при сборке видов.
+
+    Каждый пакет собирается один раз для каждой комбинации имени, версии и интерпретатора (последнее
+    закодировано в имени wheel-файла), после чего виды устанавливают его из кэша без обращения к сети.
+    Размер кэша ограничен: при превышении max_size удаляются пакеты, дольше всего не использовавшиеся
+    при установке. Время последнего использования хранится в индексе usage.json.
+
+    Сборки видов используют кэш одновременно: каждая собирает пакеты в собственную временную директорию
+    (см. Wheelhouse.stage) и атомарно переносит их в кэш. Вытеснение выполняется, только когда кэш
+    не используется ни одной сборкой, поэтому пакеты не удаляются во время установки.
+    """
+
+    INDEX = "usage.json"
+
+    def __init__(self, directory, max_size=2 * 1024 ** 3):
+        """Инициализирует кэш.
+
+        :param directory: Директория кэша
+        :type directory: str
+        :param max_size: Максимальный размер кэша в байтах
+        :type max_size: int
+        """
+        self.__directory__ = directory
+        self.__max_size__ = max_size
+        self.__users__ = 0
+
+        if not os.path.exists(self.__directory__):
+            os.makedirs(self.__directory__)
+
+        for name in os.listdir(self.__directory__):
+            if name.startswith(".build-"):
+                shutil.rmtree(os.path.join(self.__directory__, name), ignore_errors=True)
+
+    @property
+    def directory(self):
+        """Директория кэша.
+
+        :returns: Полный путь к директории кэша
+        :rtype: str
+        """
+        return self.__directory__
+
+    @staticmethod
+    def normalize(name):
+        """Приводит имя пакета к виду, используемому в именах wheel-файлов.
+
+        :param name: Имя пакета
+        :type name: str
+        :returns: Нормализованное имя
+        :rtype: str
+        """
+        return re.sub(r"[-_.]+", "_", name).lower()
+
+    @property
+    def wheels(self):
+        """Список wheel-файлов в кэше.
+
+        :returns: Список имен файлов
+        :rtype: list
+        """
+        return [_ for _ in os.listdir(self.__directory__) if _.endswith(".whl")]
+
+    def __load_usage__(self):
+        """Загружает индекс использования пакетов.
+
+        :returns: Словарь времени последнего использования по именам файлов
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self.__directory__, self.INDEX), "r") as f:
+                return load(f)
+        except (IOError, JSONDecodeError):
+            return {}
+
+    def __save_usage__(self, usage):
+        """Атомарно сохраняет индекс использования пакетов.
+
+        :param usage: Словарь времени последнего использования по именам файлов
+        :type usage: dict
+        """
+        tmp_path = os.path.join(self.__directory__, ".{}.tmp".format(self.INDEX))
+
+        with open(tmp_path, "w") as f:
+            dump(usage, f)
+
+        os.rename(tmp_path, os.path.join(self.__directory__, self.INDEX))
+
+    def stage(self):
+        """Начинает использование кэша сборкой.
+
+        :returns: Путь к временной директории, в которую сборка собирает недостающие пакеты
+        :rtype: str
+        """
+        self.__users__ += 1
+        return tempfile.mkdtemp(prefix=".build-", dir=self.__directory__)
+
+    def publish(self, staging):
+        """Переносит собранные пакеты из временной директории в кэш.
+
+        :param staging: Временная директория, полученная от Wheelhouse.stage
+        :type staging: str
+        :returns: Количество перенесенных wheel-файлов
+        :rtype: int
+        """
+        published = 0
+
+        for wheel in os.listdir(staging):
+            if wheel.endswith(".whl"):
+                os.rename(os.path.join(staging, wheel), os.path.join(self.__directory__, wheel))
+                published += 1
+
+        return published
+
+    def release(self, staging):
+        """Завершает использование кэша сборкой и вытесняет пакеты, если кэш больше никем не используется.
+
+        :param staging: Временная директория, полученная от Wheelhouse.stage
+        :type staging: str
+        """
+        shutil.rmtree(staging, ignore_errors=True)
+        self.__users__ -= 1
+
+        if not self.__users__:
+            self.evict()
+
+    def mark_used(self, packages):
+        """Отмечает пакеты как использованные.
+
+        :param packages: Установленные пакеты в формате pip freeze (name==version)
+        :type packages: list
+        :returns: Количество отмеченных wheel-файлов
+        :rtype: int
+        """
+        installed = set()
+        for package in packages:
+            if "==" in package:
+                name, version = package.strip().split("==", 1)
+                installed.add("{}-{}".format(self.normalize(name), version))
+
+        now = time.time()
+        usage = self.__load_usage__()
+        marked = 0
+
+        for wheel in self.wheels:
+            name, version = wheel.split("-")[:2]
+            if "{}-{}".format(self.normalize(name), version) in installed:
+                usage[wheel] = now
+                marked += 1
+
+        self.__save_usage__(usage)
+        return marked
+
+    def evict(self):
+        """Удаляет давно не использовавшиеся пакеты, пока размер кэша превышает max_size.
+
+        Пакеты, отсутствующие в индексе, считаются использованными в момент их создания.
+
+        :returns: Список удаленных wheel-файлов
+        :rtype: list
+        """
+        usage = self.__load_usage__()
+        wheels = []
+        total = 0
+
+        for wheel in self.wheels:
+            stat = os.stat(os.path.join(self.__directory__, wheel))
+            wheels.append((usage.get(wheel, stat.st_mtime), wheel, stat.st_size))
+            total += stat.st_size
+
+        removed = []
+        for used, wheel, size in sorted(wheels):
+            if total <= self.__max_size__:
+                break
+
+            os.remove(os.path.join(self.__directory__, wheel))
+            usage.pop(wheel, None)
+            removed.append(wheel)
+            total -= size
+
+        if removed:
+            log_message("Evicted {} wheels from wheelhouse".format(len(removed)), "Species")
+
+        for wheel in set(usage) - set(self.wheels):
+            del usage[wheel]
+
+        self.__save_usage__(usage)
+        return removed
@@ -115,7 +115,22 @@ def build_uwsgi(target):
         print("done")
         # ==========
 
-        for f in ["uwsgi", "python2_plugin.so", "python3_plugin.so"]:
+        # ==========
+        # uwsgi cheaper_busyness plugin
+        print("Building cheaper_busyness plugin...", end="")
+        sys.stdout.flush()
+        proc = subprocess.Popen([
+            "python2", uwsgiconfig_executable,
+            "--plugin", "plugins/cheaper_busyness",
+            "forest"
+        ], stdout=DEVNULL, stderr=DEVNULL, cwd=uwsgi_dir)
+        res = proc.wait()
+        if res:
+            raise Exception("Error building cheaper_busyness plugin")
+        print("done")
+        # ==========
+
+        for f in ["uwsgi", "python2_plugin.so", "python3_plugin.so", "cheaper_busyness_plugin.so"]:
             shutil.copy(os.path.join(uwsgi_dir, f), target)
     except Exception as e:
         print("Error building uwsgi: {}".format(e))
@@ -0,0 +1,20 @@
+# coding=utf-8
+"""Служебные rpc-функции, регистрируемые в листе.
+
+Модуль импортируется uwsgi внутри листа, поэтому не зависит от пакета forest и совместим
+с обеими версиями python.
+"""
+import uwsgi
+
+
+def cache_clear():
+    """Очищает кэш ответов листа.
+
+    :returns: Пустой ответ
+    :rtype: bytes
+    """
+    uwsgi.cache_clear("responses")
+    return b""
+
+
+uwsgi.register_rpc("forest_cache_clear", cache_clear)
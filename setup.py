@@ -22,7 +22,7 @@ setup(
         'forest.utils'
     ],
     package_data={
-        'forest': ['jsonschema/schema/*.json'],
+        'forest': ['jsonschema/schema/*.json', 'uwsgi/*.py'],
     },
     long_description=(""),
     classifiers=[
@@ -38,6 +38,7 @@ setup(
     ],
     install_requires=[
         "dateutils",
+        "futures",
         "jsonschema",
         "motor",
         "psutil",
@@ -51,6 +52,9 @@ setup(
         "virtualenv",
         "pygments"
     ],
+    extras_require={
+        "inotify": ["pyinotify"],
+    },
     entry_points={
         'console_scripts': [
             'forest = forest:main',
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Измеряет стоимость построения конфигураций листьев.
+
+Скрипт создает заданное количество листьев и несколько раз строит их конфигурации, как это происходит
+при запуске листьев и при каждой сверке состояния друидом. Сравниваются построение конфигурации
+без кэша и через Leaf.get_config с кэшем.
+
+Запуск: python tools/bench_leaf_config.py [количество листьев] [количество проходов]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import datetime
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forest.components.leaf import Leaf  # noqa
+from forest.components.species import Species  # noqa
+
+
+def make_leaves(directory, count, species_count=10):
+    """Создает листья для измерений.
+
+    :param directory: Директория видов
+    :type directory: str
+    :param count: Количество листьев
+    :type count: int
+    :param species_count: Количество видов, между которыми распределяются листья
+    :type species_count: int
+    :returns: Список листьев
+    :rtype: list
+    """
+    species = [
+        Species(
+            _id=ObjectId(),
+            url="https://example.com/species.git",
+            modified=datetime.datetime.now(),
+            directory=directory
+        )
+        for _ in range(species_count)
+    ]
+
+    return [
+        Leaf(
+            _id=ObjectId(),
+            address=["leaf{}.example.com".format(i), "www.leaf{}.example.com".format(i)],
+            batteries={"mysql": {"host": "127.0.0.1", "port": 3306, "user": "u", "pass": "p", "name": "db"}},
+            fastrouters=["10.0.0.1:3333", "10.0.0.2:3333", "10.0.0.3:3333"],
+            keyfile="/etc/forest/keyfile",
+            leaf_host="127.0.0.1",
+            log_port=5122,
+            settings={"DEBUG": False, "SECRET_KEY": "x" * 64, "ALLOWED_HOSTS": ["*"]},
+            species=species[i % species_count],
+            uwsgi_cron=[["0", "-1", "-1", "-1", "-1", "python manage.py clearsessions"]],
+            uwsgi_mules=["mule.py"]
+        )
+        for i in range(count)
+    ]
+
+
+def measure(render, leaves, passes):
+    """Измеряет время построения конфигураций.
+
+    :param render: Функция, строящая конфигурацию листа
+    :type render: function
+    :param leaves: Список листьев
+    :type leaves: list
+    :param passes: Количество проходов по всем листьям
+    :type passes: int
+    :returns: Время каждого прохода в секундах
+    :rtype: list
+    """
+    timings = []
+
+    for _ in range(passes):
+        started = time.time()
+        for leaf in leaves:
+            render(leaf)
+        timings.append(time.time() - started)
+
+    return timings
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    passes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    directory = tempfile.mkdtemp()
+
+    try:
+        leaves = make_leaves(directory, count)
+
+        before = measure(lambda leaf: leaf.__get_config__(), leaves, passes)
+        after = measure(lambda leaf: leaf.get_config(), leaves, passes)
+
+        print("Leaves: {}, passes: {}".format(count, passes))
+        print("Uncached: {:.3f}s per pass, {:.1f}us per leaf".format(
+            sum(before) / passes, sum(before) / passes / count * 1e6
+        ))
+        print("Cached:   {:.3f}s first pass, {:.3f}s per following pass, {:.1f}us per leaf".format(
+            after[0], sum(after[1:]) / max(passes - 1, 1), sum(after[1:]) / max(passes - 1, 1) / count * 1e6
+        ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()